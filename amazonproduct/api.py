@@ -7,7 +7,8 @@
 __docformat__ = "restructuredtext en"
 
 from base64 import b64encode
-from datetime import datetime, timedelta
+import copy
+from datetime import timedelta
 
 try: # make it python2.4 compatible!
     from hashlib import sha256
@@ -16,7 +17,10 @@ except ImportError: # pragma: no cover
 
 import hmac
 import socket
-from time import strftime, gmtime, sleep
+from StringIO import StringIO
+import sys
+import threading
+from time import strftime, gmtime, time
 import urllib2
 
 try: # make it python2.4 compatible!
@@ -25,9 +29,12 @@ except ImportError: # pragma: no cover
     from urllib import quote
 
 from amazonproduct.version import VERSION
+from amazonproduct.connection import DEFAULT_POOL, GzipStream
 from amazonproduct.errors import *
 from amazonproduct.paginators import paginate
-from amazonproduct.processors import LxmlObjectifyProcessor
+from amazonproduct.processors import LxmlObjectifyProcessor, as_string
+from amazonproduct.throttling import shared_limiter
+from amazonproduct.workers import Future, WorkerPool
 
 USER_AGENT = ('python-amazon-product-api/%s '
     '+http://pypi.python.org/pypi/python-amazon-product-api/' % VERSION)
@@ -42,6 +49,169 @@ HOSTS = {
     'us' : ('ecs.amazonaws.com', 'xml-us.amznxslt.com'),
 }
 
+def _quote_param(key, val):
+    """
+    Returns URL-encoded ``key=value`` pair as required for signed requests.
+    """
+    return '%s=%s' % (key, quote(unicode(val).encode('utf-8'), safe='~'))
+
+
+class SigningContext (object):
+
+    """
+    Signs request URLs for one set of credentials. Everything which does not
+    change between requests is prepared once: the HMAC is keyed in advance
+    and only copied for each request, constant parameters (like
+    ``AWSAccessKeyId``, ``Service`` and ``Version``) are quoted beforehand
+    and the timestamp is formatted at most once per second.
+    """
+
+    def __init__(self, access_key, secret_key, version, associate_tag=None):
+        self.key = (access_key, secret_key, version, associate_tag)
+        self.hmac = hmac.new(secret_key, digestmod=sha256)
+        constants = {
+            'AWSAccessKeyId' : access_key,
+            'Service' : 'AWSECommerceService',
+            # use the version this class was build for by default
+            'Version' : version,
+        }
+        if associate_tag:
+            constants['AssociateTag'] = associate_tag
+        self.constants = dict((key, _quote_param(key, val))
+                              for key, val in constants.items())
+        self._prefixes = {}
+        self._timestamp = (None, None)
+
+    def timestamp(self):
+        """
+        Returns quoted parameter ``Timestamp`` for the current second.
+        """
+        now = int(time())
+        second, param = self._timestamp
+        if second != now:
+            param = _quote_param('Timestamp',
+                                 strftime('%Y-%m-%dT%H:%M:%SZ', gmtime(now)))
+            self._timestamp = (now, param)
+        return param
+
+    def prefix(self, host):
+        """
+        Returns beginning of the string to sign for requests to ``host``.
+        """
+        try:
+            return self._prefixes[host]
+        except KeyError:
+            prefix = self._prefixes[host] = 'GET\n%s\n/onca/xml\n' % host
+            return prefix
+
+    def sign(self, hosts, qargs, timestamp=None, quoted=None):
+        """
+        Returns signed URL for query parameters ``qargs``.
+
+        :param hosts: tuple of hosts for normal and XSLT requests.
+        :param timestamp: quoted timestamp parameter (the current time is used
+          if ``None``).
+        :param quoted: optional dictionary used to look up (and store) quoted
+          parameters by ``(key, type(value), value)``.
+        """
+        params = dict(self.constants)
+        # remove empty (=None) parameters
+        for key, val in qargs.items():
+            if val is None:
+                continue
+            if quoted is None:
+                params[key] = _quote_param(key, val)
+                continue
+            # the type is part of the key because 1, 1.0 and True are equal
+            # (and hash the same) but are quoted differently
+            memo = (key, type(val), val)
+            try:
+                params[key] = quoted[memo]
+            except KeyError:
+                params[key] = quoted[memo] = _quote_param(key, val)
+            except TypeError:
+                # unhashable values (e.g. lists) are not cached
+                params[key] = _quote_param(key, val)
+
+        # add timestamp (this is required when using a signature)
+        params['Timestamp'] = timestamp or self.timestamp()
+
+        # create signature
+        keys = sorted(params.keys())
+        args = '&'.join([params[key] for key in keys])
+
+        # Amazon uses a different host for XSLT operations
+        host = hosts[qargs.get('Style') is not None]
+
+        digest = self.hmac.copy()
+        digest.update(self.prefix(host) + args)
+        signature = quote(b64encode(digest.digest()))
+
+        return 'http://%s/onca/xml?%s&Signature=%s' % (host, args, signature)
+
+    def sign_many(self, hosts, qargs_list):
+        """
+        Returns list of signed URLs, one for each dictionary of query
+        parameters in ``qargs_list``. All URLs share the same timestamp and
+        parameters which occur in several requests are quoted only once.
+        """
+        timestamp = self.timestamp()
+        quoted = {}
+        return [self.sign(hosts, qargs, timestamp, quoted)
+                for qargs in qargs_list]
+
+
+class LazyResponse (object):
+
+    """
+    Unparsed response returned by ``API(..., lazy=True)``. It keeps the raw
+    XML in ``data`` and only parses it when the result is first accessed::
+
+        api = API(AWS_KEY, SECRET_KEY, 'us', lazy=True)
+        result = api.item_lookup('0201896834')
+        cache.set('0201896834', result.data) # not parsed yet
+        print result.Items.Item.ItemAttributes.Title # parsed now
+
+    Responses containing errors are never lazy (the API call raises the
+    appropriate exception right away), so if you get a ``LazyResponse`` the
+    request was successful.
+    """
+
+    def __init__(self, data, parse):
+        """
+        :param data: XML response (string).
+        :param parse: function returning the parsed result for ``data``.
+        """
+        self.data = data
+        self._parse = parse
+        self._root = None
+
+    def _get_root(self):
+        if self._root is None:
+            self._root = self._parse(self.data)
+        return self._root
+    root = property(_get_root, doc='Parsed result (as returned by the '
+                                   'response processor).')
+
+    def parsed(self):
+        """
+        Returns ``True`` if the response has been parsed already.
+        """
+        return self._root is not None
+
+    def __getattr__(self, name):
+        # avoid recursion for special attributes (e.g. used by copy, pickle)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.root, name)
+
+    def __iter__(self):
+        return iter(self.root)
+
+    def __str__(self):
+        return self.data
+
+
 class API (object):
 
     """
@@ -85,16 +255,27 @@ class API (object):
 
     VERSION = '2010-12-01' #: supported Amazon API version
     REQUESTS_PER_SECOND = 1 #: max requests per second
+    MAX_LOOKUP_IDS = 10 #: max ItemIds per ItemLookup request
+    MAX_RETRIES = 3 #: max retries of throttled requests (adaptive limiters)
     TIMEOUT = 5 #: timeout in seconds
 
     def __init__(self, access_key_id, secret_access_key, locale,
-                 associate_tag=None, processor=None):
+                 associate_tag=None, processor=None, pool=None, limiter=None,
+                 lazy=False):
         """
         :param access_key_id: AWS access key ID.
         :param secret_key_id: AWS secret key.
         :param associate_tag: Amazon Associates tracking id.
         :param locale: localise results by using one value from ``LOCALES``.
         :param processor: result processing function (``None`` if unsure).
+        :param pool: ``ConnectionPool`` used for keep-alive connections (if
+          ``None``, a pool shared by all API instances is used).
+        :param limiter: rate limiter (see ``amazonproduct.throttling``) used
+          to throttle requests. If ``None``, all API instances using the same
+          access key and locale share one ``TokenBucket`` at
+          ``REQUESTS_PER_SECOND``.
+        :param lazy: if ``True``, successful responses are returned as
+          ``LazyResponse`` which is only parsed when it is accessed.
         """
         self.access_key = access_key_id
         self.secret_key = secret_access_key
@@ -108,11 +289,54 @@ class API (object):
 
         socket.setdefaulttimeout(self.TIMEOUT)
 
-        self.last_call = datetime(1970, 1, 1)
-        self.throttle = timedelta(seconds=1)/self.REQUESTS_PER_SECOND
+        # each locale's endpoint has a request budget of its own
+        self.limiter = limiter or shared_limiter(access_key_id,
+            self.REQUESTS_PER_SECOND, locale=self.locale)
         self.debug = 0 # set to 1 if you want to see HTTP headers
 
         self.response_processor = processor or LxmlObjectifyProcessor()
+        self.pool = pool or DEFAULT_POOL
+        self.lazy = lazy
+
+    def _get_throttle(self):
+        rate = getattr(self.limiter, 'rate', None)
+        if not rate:
+            # limiter does not reveal its rate
+            return None
+        return timedelta(seconds=1/float(rate))
+    def _set_throttle(self, delay):
+        if isinstance(delay, timedelta):
+            delay = delay.days * 86400 + delay.seconds \
+                    + delay.microseconds / 1000000.0
+        if delay <= 0:
+            raise ValueError('Delay between requests must be positive!')
+        set_rate = getattr(self.limiter, 'set_rate', None)
+        if set_rate is not None:
+            set_rate(1 / float(delay))
+        elif getattr(self.limiter, 'rate', None) is not None:
+            self.limiter.rate = 1 / float(delay)
+        else:
+            raise TypeError('Rate of %s cannot be changed!' %
+                            self.limiter.__class__.__name__)
+    throttle = property(_get_throttle, _set_throttle, doc='Minimum delay '
+        'between requests (``timedelta`` or seconds when set, ``None`` if '
+        'the limiter has no ``rate``). Setting it changes the rate of the '
+        'limiter itself: the default limiter is shared by all instances '
+        'using the same access key and locale, which are all slowed down '
+        '(or sped up) alike. Pass a limiter of your own to throttle a single '
+        'instance.')
+
+    def _signing_context(self):
+        """
+        Returns ``SigningContext`` for the current credentials and settings.
+        It is created once and only replaced if any of them change.
+        """
+        key = (self.access_key, self.secret_key, self.VERSION,
+               self.associate_tag)
+        context = getattr(self, '_signing', None)
+        if context is None or context.key != key:
+            context = self._signing = SigningContext(*key)
+        return context
 
     def _build_url(self, **qargs):
         """
@@ -120,81 +344,86 @@ class API (object):
         on code by Adam Cox (found at
         http://blog.umlungu.co.uk/blog/2009/jul/12/pyaws-adding-request-authentication/)
         """
-        # remove empty (=None) parameters
-        for key, val in qargs.items():
-            if val is None:
-                del qargs[key]
-
-        if 'AWSAccessKeyId' not in qargs:
-            qargs['AWSAccessKeyId'] = self.access_key
-
-        if 'Service' not in qargs:
-            qargs['Service'] = 'AWSECommerceService'
-
-        # use the version this class was build for by default
-        if 'Version' not in qargs:
-            qargs['Version'] = self.VERSION
-
-        if 'AssociateTag' not in qargs and self.associate_tag:
-            qargs['AssociateTag'] = self.associate_tag
-
-        # add timestamp (this is required when using a signature)
-        qargs['Timestamp'] = strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())
-
-        # create signature
-        keys = sorted(qargs.keys())
-        args = '&'.join('%s=%s' % (key, quote(unicode(qargs[key])
-                        .encode('utf-8'),safe='~')) for key in keys)
+        return self._signing_context().sign(self.host, qargs)
 
-        # Amazon uses a different host for XSLT operations
-        host = self.host['Style' in qargs]
+    def build_urls(self, list_of_param_dicts):
+        """
+        Builds signed URLs for a whole list of requests at once (which is
+        considerably faster than calling :meth:`_build_url` for each one)::
 
-        msg = 'GET'
-        msg += '\n' + host
-        msg += '\n/onca/xml'
-        msg += '\n' + args
+            urls = api.build_urls([
+                {'Operation' : 'ItemLookup', 'ItemId' : asin}
+                for asin in asins])
 
-        signature = quote(
-            b64encode(hmac.new(self.secret_key, msg, sha256).digest()))
+        All URLs carry the same timestamp. Keep in mind that Amazon rejects
+        requests whose timestamp is more than 15 minutes old!
 
-        url = 'http://%s/onca/xml?%s&Signature=%s' % (host, args, signature)
-        return url
+        :param list_of_param_dicts: iterable of dictionaries with query
+          parameters as passed to :meth:`_build_url`.
+        """
+        return self._signing_context().sign_many(self.host,
+                                                 list_of_param_dicts)
 
     def _fetch(self, url):
         """
         Calls the Amazon Product Advertising API and returns the response.
         """
-        request = urllib2.Request(url)
-        request.add_header('User-Agent', USER_AGENT)
-        request.add_header('Accept-encoding', 'gzip')
-
-        # Be nice and wait for some time
-        # before submitting the next request
-        delta = datetime.now() - self.last_call
-        if delta < self.throttle:
-            wait = self.throttle-delta
-            sleep(wait.seconds+wait.microseconds/1000000.0) # pragma: no cover
-        self.last_call = datetime.now()
-
+        headers = {
+            'User-Agent' : USER_AGENT,
+            'Accept-Encoding' : 'gzip',
+        }
+
+        retries = 0
+        while True:
+            # Be nice and wait for some time
+            # before submitting the next request
+            self.limiter.acquire()
+            try:
+                response = self.pool.urlopen(url, headers, self.debug)
+                break
+            except urllib2.HTTPError, e:
+                if e.code != 503:
+                    # otherwise re-raise
+                    raise # pragma: no cover
+                e.close()
+                # adaptive rate limiters slow down and retry
+                throttled = getattr(self.limiter, 'throttled', None)
+                if throttled is None or retries >= self.MAX_RETRIES:
+                    raise TooManyRequests
+                throttled()
+                retries += 1
+
+        if hasattr(self.limiter, 'success'):
+            self.limiter.success()
+
+        # handle compressed data (decompressed while being read)
+        if response.headers.get('Content-Encoding') == 'gzip':
+            return GzipStream(response)
+        return response
+
+    def _fetch_response(self, url):
+        """
+        Like ``_fetch(url)`` but HTTP errors 400 (Bad Request) and 410 (Gone)
+        are not raised. Their body contains a more detailed error message which
+        is returned to be parsed like any other response.
+        """
         try:
-            opener = urllib2.build_opener()
-            handler = urllib2.HTTPHandler(debuglevel=self.debug)
-            opener = urllib2.build_opener(handler)
-            response = opener.open(request)
-            # handle compressed data
-            # Borrowed from Mark Pilgrim's excellent introduction
-            # http://diveintopython.org/http_web_services/gzip_compression.html
-            if response.headers.get('Content-Encoding') == 'gzip':
-                import StringIO
-                import gzip
-                stream = StringIO.StringIO(response.read())
-                return gzip.GzipFile(fileobj=stream)
-            return response
+            return self._fetch(url)
         except urllib2.HTTPError, e:
-            if e.code == 503:
-                raise TooManyRequests
-            # otherwise re-raise
-            raise # pragma: no cover
+            if e.code in (400, 410):
+                return e.fp
+            raise
+
+    def _fetch_data(self, url):
+        """
+        Calls the Amazon Product Advertising API and returns the complete
+        (decompressed) response as a single string (see ``_fetch_response``).
+        """
+        fp = self._fetch_response(url)
+        try:
+            return fp.read()
+        finally:
+            fp.close()
 
     def _reg(self, key):
         """
@@ -214,27 +443,57 @@ class API (object):
         try:
             return self.response_processor(fp)
         except AWSError, e:
+            self._convert_error(e)
+            # otherwise simply re-raise
+            raise
 
-            if e.code == 'Deprecated':
-                raise DeprecatedOperation(e.msg)
+    def _parse_data(self, data):
+        """
+        Processes the AWS response contained in a string (or buffer). Response
+        processors with a method ``fromstring()`` are fed the data directly,
+        all others get a file-like object.
+        """
+        processor = self.response_processor
+        try:
+            if hasattr(processor, 'fromstring'):
+                return processor.fromstring(data)
+            return processor(StringIO(as_string(data)))
+        except AWSError, e:
+            self._convert_error(e)
+            # otherwise simply re-raise
+            raise
 
-            if e.code == 'AWS.ECommerceService.NoExactMatches':
-                raise NoExactMatchesFound
+    def _parse_lazily(self, data):
+        """
+        Returns ``LazyResponse`` for response ``data``. Only if the response
+        contains an error (which is checked without parsing) it is parsed
+        right away to raise the corresponding exception. Either way the data
+        is parsed with ``_parse_data()``.
+        """
+        if '<Error>' in data:
+            return self._parse_data(data)
+        return LazyResponse(data, self._parse_data)
 
-            if e.code == 'AWS.ECommerceService.NoExactMatches':
-                raise NoExactMatchesFound
+    def _convert_error(self, e):
+        """
+        Raises a more specific exception for ``AWSError`` ``e`` (if there is
+        one). Error codes which are specific to an operation are handled by
+        the operation itself.
+        """
+        if e.code == 'Deprecated':
+            raise DeprecatedOperation(e.msg)
 
-            if e.code == 'AWS.InvalidParameterValue':
-                m = self._reg('invalid-parameter-value').search(e.msg)
-                raise InvalidParameterValue(m.group('parameter'),
-                                            m.group('value'))
+        if e.code == 'AWS.ECommerceService.NoExactMatches':
+            raise NoExactMatchesFound
 
-            if e.code == 'AWS.RestrictedParameterValueCombination':
-                m = self._reg('invalid-parameter-combination').search(e.msg)
-                raise InvalidParameterCombination(m.group('message'))
+        if e.code == 'AWS.InvalidParameterValue':
+            m = self._reg('invalid-parameter-value').search(e.msg)
+            raise InvalidParameterValue(m.group('parameter'),
+                                        m.group('value'))
 
-            # otherwise simply re-raise
-            raise
+        if e.code == 'AWS.RestrictedParameterValueCombination':
+            m = self._reg('invalid-parameter-combination').search(e.msg)
+            raise InvalidParameterCombination(m.group('message'))
 
     def call(self, **qargs):
         """
@@ -244,18 +503,16 @@ class API (object):
 
         * ``_build_url(**query_parameters)``
         * ``_fetch(url)``
-        * ``_parse(fp)``
+        * ``_parse(fp)`` (or ``_parse_data(data)`` if ``lazy`` is set)
+
+        Lazy responses are read completely and handed to ``_parse_data()`` as
+        a string (when they are accessed), they never go through ``_parse()``.
+        Override both methods to customise parsing in either mode.
         """
         url = self._build_url(**qargs)
-        try:
-            fp = self._fetch(url)
-            return self._parse(fp)
-        except urllib2.HTTPError, e:
-            # HTTP errors 400 (Bad Request) and 410 (Gone) send a more detailed
-            # error message as body which can be parsed, too.
-            if e.code in (400, 410):
-                return self._parse(e.fp)
-            raise
+        if self.lazy:
+            return self._parse_lazily(self._fetch_data(url))
+        return self._parse(self._fetch_response(url))
 
     def item_lookup(self, item_id, **params):
         """
@@ -276,17 +533,124 @@ class API (object):
         try:
             return self.call(Operation='ItemLookup', ItemId=item_id, **params)
         except AWSError, e:
+            self._convert_lookup_error(e, params)
+            # otherwise re-raise exception
+            raise # pragma: no cover
 
-            if (e.code == 'AWS.InvalidEnumeratedParameter'
-            and self._reg('invalid-value').search(e.msg)
-                    .group('parameter') == 'SearchIndex'):
-                raise InvalidSearchIndex(params.get('SearchIndex'))
+    def _convert_lookup_error(self, e, params):
+        """
+        Raises a more specific exception for ``AWSError`` ``e`` returned for
+        an ``ItemLookup`` request with ``params`` (if there is one).
+        """
+        if (e.code == 'AWS.InvalidEnumeratedParameter'
+        and self._reg('invalid-value').search(e.msg)
+                .group('parameter') == 'SearchIndex'):
+            raise InvalidSearchIndex(params.get('SearchIndex'))
 
-            if e.code == 'AWS.InvalidResponseGroup':
-                raise InvalidResponseGroup(params.get('ResponseGroup'))
+        if e.code == 'AWS.InvalidResponseGroup':
+            raise InvalidResponseGroup(params.get('ResponseGroup'))
 
-            # otherwise re-raise exception
-            raise # pragma: no cover
+    def item_lookup_many(self, ids, workers=1, **params):
+        """
+        Looks up any number of items using as few ``ItemLookup`` requests as
+        possible. Duplicate ids are removed and the remaining ones are sent in
+        chunks of ``MAX_LOOKUP_IDS``. Returns tuple ``(items, invalid)`` with a
+        dict of ``Item`` nodes keyed by ASIN and a list of all ids Amazon
+        rejected as invalid::
+
+            items, invalid = api.item_lookup_many(asins, ResponseGroup='Large')
+            for asin in asins:
+                if asin in items:
+                    print asin, items[asin].ItemAttributes.Title
+
+        .. note:: For an ``IdType`` other than ``ASIN``, items are still keyed
+           by their ASIN (a single ISBN or EAN may even match several items).
+
+        :param ids: iterable of item ids.
+        :param workers: number of chunks to fetch concurrently. Requests are
+          still throttled by the rate limiter.
+        """
+        unique, seen = [], set()
+        for item_id in ids:
+            if item_id not in seen:
+                seen.add(item_id)
+                unique.append(item_id)
+
+        invalid = []
+        def lookup(chunk):
+            split = getattr(self.response_processor, 'split_items', None)
+            if split is None:
+                return retry(list(chunk))
+            url = self._build_url(Operation='ItemLookup',
+                                  ItemId=','.join(chunk), **params)
+            fp = self._fetch_response(url)
+            try:
+                items, errors = split(fp)
+            except AWSError, e:
+                self._convert_error(e)
+                self._convert_lookup_error(e, params)
+                raise
+            # invalid ids are reported along with the items of all valid ones
+            for e in errors:
+                if e.code == 'AWS.InvalidParameterValue':
+                    m = self._reg('invalid-parameter-value').search(e.msg)
+                    if (m and m.group('parameter') == 'ItemId'
+                    and m.group('value') in chunk):
+                        invalid.append(m.group('value'))
+                        continue
+                self._convert_error(e)
+                self._convert_lookup_error(e, params)
+                raise e
+            return items
+
+        def retry(chunk):
+            # processors which cannot split the response fail the whole
+            # request for a single invalid id, so it is removed and the
+            # request is repeated for the remaining ids
+            while chunk:
+                try:
+                    # always use blocking call (even for AsyncAPI)
+                    root = API.item_lookup(self, ','.join(chunk), **params)
+                    if isinstance(root, LazyResponse):
+                        root = root.root
+                    return self.response_processor.items(root)
+                except InvalidParameterValue, e:
+                    parameter, value = e.args
+                    if parameter != 'ItemId' or value not in chunk:
+                        raise
+                    chunk.remove(value)
+                    invalid.append(value)
+            return []
+
+        size = self.MAX_LOOKUP_IDS
+        chunks = [unique[i:i+size] for i in range(0, len(unique), size)]
+        if workers > 1 and len(chunks) > 1:
+            # once a chunk has failed, the queued ones are skipped rather
+            # than spending requests on a call which has failed anyway
+            failed = threading.Event()
+            def guarded(chunk):
+                if failed.isSet():
+                    return []
+                try:
+                    return lookup(chunk)
+                except:
+                    failed.set()
+                    raise
+            pool = WorkerPool(min(workers, len(chunks)))
+            try:
+                futures = [pool.submit(guarded, chunk) for chunk in chunks]
+                results = [future.result() for future in futures]
+            finally:
+                pool.shutdown(wait=False)
+        else:
+            results = map(lookup, chunks)
+
+        items = {}
+        for result in results:
+            items.update(result)
+        order = dict([(item_id, no) for no, item_id in enumerate(unique)])
+        invalid.sort(key=order.get)
+        return items, invalid
 
     @paginate
     def item_search(self, search_index, **params):
@@ -336,6 +700,47 @@ class API (object):
             # otherwise re-raise exception
             raise # pragma: no cover
 
+    @paginate
+    def item_reviews(self, item_id, **params):
+        """
+        Returns all pages of customer reviews for an item (using ``ItemLookup``
+        with response group ``Reviews`` and parameter ``ReviewPage``)::
+
+            for root in api.item_reviews('0747532745'):
+                for review in root.Items.Item.CustomerReviews.Review:
+                    print review.Rating, review.Summary
+
+        .. note:: Since November 2010, Amazon only returns an ``IFrameURL``
+           for customer reviews (which means there is only one page).
+        """
+        params.setdefault('ResponseGroup', 'Reviews')
+        # always use blocking call (even for AsyncAPI)
+        return API.item_lookup(self, item_id, **params)
+
+    @paginate
+    def item_offers(self, item_id, **params):
+        """
+        Returns all pages of offers for an item (using ``ItemLookup`` with
+        response group ``Offers`` and parameter ``OfferPage``)::
+
+            for root in api.item_offers('0747532745', Condition='All'):
+                for offer in root.Items.Item.Offers.Offer:
+                    print offer.OfferListing.Price.FormattedPrice
+        """
+        params.setdefault('ResponseGroup', 'Offers')
+        # always use blocking call (even for AsyncAPI)
+        return API.item_lookup(self, item_id, **params)
+
+    @paginate
+    def item_variations(self, item_id, **params):
+        """
+        Returns all pages of variations of an item (using ``ItemLookup`` with
+        response group ``Variations`` and parameter ``VariationPage``).
+        """
+        params.setdefault('ResponseGroup', 'Variations')
+        # always use blocking call (even for AsyncAPI)
+        return API.item_lookup(self, item_id, **params)
+
     def similarity_lookup(self, *ids, **params):
         """
         The ``SimilarityLookup`` operation returns up to ten products per page
@@ -697,6 +1102,264 @@ class API (object):
     vehicle_part_lookup = vehicle_part_search = deprecated_operation
     vehicle_search = deprecated_operation
 
-    #: MultiOperation is supported outside this API
-    multi_operation = None
+    def batch(self):
+        """
+        Returns a ``Batch`` which combines up to two operations with up to two
+        requests each into one single request (see ``Batch`` for details).
+        """
+        return Batch(self)
+
+    #: MultiOperation is supported via batch requests
+    multi_operation = batch
+
+
+class Batch (object):
+
+    """
+    Batch and multi-operation requests. Amazon allows up to two operations
+    with up to two requests each to be combined into one single request. Call
+    any operation on the batch just as you would on the API and you will get
+    a ``Future`` back. All requests are sent with :meth:`execute` after which
+    each ``Future`` holds either the result of its own request or the
+    exception it raised::
+
+        batch = api.batch()
+        vol1 = batch.item_lookup('0201896834')
+        vol2 = batch.item_lookup('0201896842')
+        similar = batch.similarity_lookup('0201896834')
+        batch.execute()
+
+        print vol1.result().Items.Item.ItemAttributes.Title
+        try:
+            print similar.result().Items.Item
+        except NoSimilarityForASIN:
+            pass
+
+    Paginators are not available in batch mode, ``item_search`` will return
+    the requested page only.
+
+    .. note:: Your response processor needs to provide a method
+       ``split(fp)`` (like ``LxmlObjectifyProcessor`` does).
+    """
+
+    MAX_OPERATIONS = 2 #: max different operations per request
+    MAX_REQUESTS = 2 #: max requests per operation
+
+    #: operations which can be used in batch mode
+    OPERATIONS = ('item_lookup', 'item_search', 'similarity_lookup',
+        'browse_node_lookup', 'cart_create', 'cart_add', 'cart_modify',
+        'cart_get', 'cart_clear')
+
+    def __init__(self, api):
+        self.api = api
+        self._requests = [] # (operation, qargs, name, args, kwargs, future)
+
+    def _proxy(self, call):
+        """
+        Returns copy of API instance using function ``call`` instead of
+        sending requests.
+        """
+        proxy = copy.copy(self.api)
+        proxy.call = call
+        # disable paginators
+        proxy.response_processor = None
+        return proxy
+
+    def _invoke(self, proxy, name, args, kwargs):
+        # always use blocking operations (even for AsyncAPI)
+        return getattr(API, name)(proxy, *args, **kwargs)
+
+    def __getattr__(self, name):
+        if name not in self.OPERATIONS:
+            raise AttributeError(name)
+
+        def operation(*args, **kwargs):
+            captured = []
+            def capture(**qargs):
+                captured.append(qargs)
+            self._invoke(self._proxy(capture), name, args, kwargs)
+            qargs = captured[0]
+            operations = [request[0] for request in self._requests]
+            if qargs['Operation'] not in operations \
+            and len(set(operations)) >= self.MAX_OPERATIONS:
+                raise ValueError('A batch can only contain %i operations!'
+                                 % self.MAX_OPERATIONS)
+            if operations.count(qargs['Operation']) >= self.MAX_REQUESTS:
+                raise ValueError('A batch can only contain %i requests per '
+                                 'operation!' % self.MAX_REQUESTS)
+
+            future = Future()
+            self._requests.append((qargs.pop('Operation'), qargs,
+                                   name, args, kwargs, future))
+            return future
+
+        operation.__name__ = name
+        return operation
+
+    def execute(self):
+        """
+        Sends all collected requests at once and sets the results of their
+        futures. Nothing is sent if no requests have been collected.
+        """
+        if not self._requests:
+            return
+        requests, self._requests = self._requests, []
+        operations, counter, params = [], {}, {}
+        for operation, qargs, _, _, _, _ in requests:
+            if operation not in operations:
+                operations.append(operation)
+            # parameters are prefixed with operation and request number,
+            # e.g. ItemLookup.1.ItemId=...&ItemLookup.2.ItemId=...
+            counter[operation] = no = counter.get(operation, 0) + 1
+            for key, val in qargs.items():
+                params['%s.%i.%s' % (operation, no, key)] = val
+        params['Operation'] = ','.join(operations)
+
+        try:
+            url = self.api._build_url(**params)
+            fp = self.api._fetch_response(url)
+            try:
+                results = self.api.response_processor.split(fp)
+            except AWSError, e:
+                self.api._convert_error(e)
+                raise
+        except:
+            exc_info = sys.exc_info()
+            for request in requests:
+                request[-1].set_exception(exc_info)
+            raise
+
+        for operation, qargs, name, args, kwargs, future in requests:
+            for no, (op, result) in enumerate(results):
+                if op == operation:
+                    del results[no]
+                    break
+            else:
+                result = AWSError('MissingResult',
+                    'Response contains no result for this request.')
+
+            def call(**qargs):
+                if isinstance(result, AWSError):
+                    self.api._convert_error(result)
+                    raise result
+                return result
+            try:
+                future.set_result(
+                    self._invoke(self._proxy(call), name, args, kwargs))
+            except:
+                future.set_exception(sys.exc_info())
+
+
+def _asynchronous(fnc):
+    """
+    Runs API method ``fnc`` in the worker pool of an ``AsyncAPI`` instance and
+    returns a ``Future`` for its result.
+    """
+    def wrapped(api, *args, **kwargs):
+        return api.workers.submit(fnc, api, *args, **kwargs)
+    wrapped.__name__ = fnc.__name__
+    wrapped.__doc__ = fnc.__doc__
+    return wrapped
+
+
+class AsyncAPI (API):
+
+    """
+    Non-blocking variant of ``API``. All operations are executed by a fixed
+    number of worker threads and immediately return a ``Future``. Calling its
+    ``result()`` method will wait for the response and return the parsed
+    result or raise the same exception the blocking operation would have::
+
+        api = AsyncAPI(AWS_KEY, SECRET_KEY, 'us', workers=8)
+        futures = dict((asin, api.item_lookup(asin)) for asin in asins)
+        for asin, future in futures.items():
+            try:
+                print asin, future.result().Items.Item.ItemAttributes.Title
+            except InvalidParameterValue:
+                print asin, 'is not a valid ASIN'
+
+    Throttling no longer blocks the caller: each request reserves the next
+    free token from the rate limiter and only the worker sending it will wait
+    for it.
+
+    .. note:: ``item_search`` returns a ``Future`` for the paginator. Only the
+       first page is fetched in the background, subsequent pages are fetched
+       while iterating over it.
+    """
 
+    def __init__(self, access_key_id, secret_access_key, locale,
+                 workers=4, **kwargs):
+        """
+        :param workers: number of requests which can be in flight at once.
+        """
+        API.__init__(self, access_key_id, secret_access_key, locale, **kwargs)
+        self.workers = WorkerPool(workers)
+
+    item_lookup = _asynchronous(API.__dict__['item_lookup'])
+    item_lookup_many = _asynchronous(API.__dict__['item_lookup_many'])
+    item_search = _asynchronous(API.__dict__['item_search'])
+    item_reviews = _asynchronous(API.__dict__['item_reviews'])
+    item_offers = _asynchronous(API.__dict__['item_offers'])
+    item_variations = _asynchronous(API.__dict__['item_variations'])
+    similarity_lookup = _asynchronous(API.__dict__['similarity_lookup'])
+    browse_node_lookup = _asynchronous(API.__dict__['browse_node_lookup'])
+    cart_create = _asynchronous(API.__dict__['cart_create'])
+    cart_add = _asynchronous(API.__dict__['cart_add'])
+    cart_modify = _asynchronous(API.__dict__['cart_modify'])
+    cart_get = _asynchronous(API.__dict__['cart_get'])
+    cart_clear = _asynchronous(API.__dict__['cart_clear'])
+
+
+class MultiLocaleAPI (object):
+
+    """
+    Sends the same request to several locales in parallel. Each locale has a
+    rate budget of its own, so looking up an item in all six locales takes no
+    longer than looking it up in one. The results are returned as dictionary
+    of finished ``Future`` objects keyed by locale, so a failure in one
+    locale does not affect the others::
+
+        api = MultiLocaleAPI(AWS_KEY, SECRET_KEY, ['de', 'fr', 'uk'])
+        results = api.item_lookup('0747532745', ResponseGroup='Offers')
+        for locale, result in results.items():
+            try:
+                print locale, result.result().Items.Item.Offers.TotalOffers
+            except AWSError, e:
+                print locale, 'failed:', e
+
+    All keyword arguments (like ``associate_tag`` or ``processor``) are passed
+    on to the ``API`` instances (one per locale) which can be accessed via
+    attribute ``apis``.
+    """
+
+    #: operations which can be sent to several locales
+    OPERATIONS = ('item_lookup', 'item_lookup_many', 'item_search',
+        'similarity_lookup', 'browse_node_lookup')
+
+    def __init__(self, access_key_id, secret_access_key, locales=None,
+                 **kwargs):
+        """
+        :param locales: list of locales (all of ``HOSTS`` if ``None``).
+        """
+        self.locales = locales or sorted(HOSTS.keys())
+        self.apis = {}
+        for locale in self.locales:
+            self.apis[locale] = API(access_key_id, secret_access_key,
+                                    locale, **kwargs)
+        self.workers = WorkerPool(len(self.locales))
+
+    def __getattr__(self, name):
+        if name not in self.OPERATIONS:
+            raise AttributeError(name)
+
+        def operation(*args, **kwargs):
+            results = {}
+            for locale in self.locales:
+                method = getattr(self.apis[locale], name)
+                results[locale] = self.workers.submit(method, *args, **kwargs)
+            for future in results.values():
+                future.exception() # wait for all requests to finish
+            return results
+
+        operation.__name__ = name
+        return operation
@@ -0,0 +1,275 @@
+# Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Persistent HTTP/1.1 connections for talking to Amazon's webservice.
+"""
+
+from base64 import b64encode
+import httplib
+import socket
+import threading
+from time import time
+import urllib
+import urllib2
+from urlparse import urlsplit
+import zlib
+
+def _proxy_for(scheme, host):
+    """
+    Returns tuple ``(proxy_host, credentials)`` for the proxy which should be
+    used for requests to ``host`` (configured by environment variables
+    ``http_proxy`` and ``no_proxy`` or system settings, just like for
+    ``urllib2``) or ``None`` to connect directly.
+    """
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(host):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    netloc = urlsplit(proxy)[1]
+    credentials = None
+    if '@' in netloc:
+        credentials, netloc = netloc.rsplit('@', 1)
+        credentials = urllib.unquote(credentials)
+    return netloc, credentials
+
+
+class ConnectionPool (object):
+
+    """
+    Pool of persistent (keep-alive) HTTP connections. Idle connections are
+    kept per host and handed out again for subsequent requests, thus saving
+    DNS lookup and TCP handshake. A pool can safely be shared between threads
+    and between several ``API`` instances (for different locales even)::
+
+        pool = ConnectionPool(maxsize=8, idle_timeout=60)
+        api_de = API(AWS_KEY, SECRET_KEY, 'de', pool=pool)
+        api_uk = API(AWS_KEY, SECRET_KEY, 'uk', pool=pool)
+
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=30):
+        """
+        :param maxsize: maximum number of idle connections kept per host.
+        :param idle_timeout: idle connections older than this (in seconds)
+          will be closed rather than reused.
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {} # host -> [(last_used, connection), ...]
+        self._lock = threading.Lock()
+
+    def _new_connection(self, host):
+        """
+        Creates a new connection to ``host`` (which may include a port).
+        """
+        return httplib.HTTPConnection(host)
+
+    def _acquire(self, host):
+        """
+        Returns tuple ``(connection, reused)`` with an idle connection to
+        ``host`` if there is one or a brand new one otherwise.
+        """
+        now = time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(host, [])
+            while idle:
+                last_used, conn = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                conn.close()
+        finally:
+            self._lock.release()
+        return self._new_connection(host), False
+
+    def release(self, host, conn):
+        """
+        Puts ``conn`` back into the pool to be reused for ``host``.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.maxsize:
+                idle.append((time(), conn))
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for _, conn in connections:
+                conn.close()
+
+    def urlopen(self, url, headers=None, debuglevel=0):
+        """
+        Sends GET request for ``url`` and returns a file-like response. The
+        connection is returned to the pool as soon as the response has been
+        read completely. HTTP errors are raised as ``urllib2.HTTPError`` just
+        like ``urllib2.urlopen`` does. Proxies are used as configured for
+        ``urllib2`` (e.g. with environment variable ``http_proxy``).
+        """
+        scheme, host, path, query, _ = urlsplit(url)
+        selector = path or '/'
+        if query:
+            selector += '?' + query
+
+        proxy = _proxy_for(scheme, host)
+        if proxy is not None:
+            # send request for absolute URL to proxy instead
+            host, credentials = proxy
+            selector = url
+            if credentials is not None:
+                headers = dict(headers or {})
+                headers['Proxy-Authorization'] = 'Basic %s' % (
+                    b64encode(credentials))
+
+        while True:
+            conn, reused = self._acquire(host)
+            conn.set_debuglevel(debuglevel)
+            try:
+                conn.request('GET', selector, headers=headers or {})
+                response = conn.getresponse()
+                break
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                # a kept-alive connection may have been closed by the
+                # server in the meantime - simply try another one
+                if not reused:
+                    raise
+
+        fp = PooledResponse(self, host, conn, response, url)
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    fp.headers, fp)
+        return fp
+
+
+class PooledResponse (object):
+
+    """
+    File-like wrapper around an ``httplib.HTTPResponse`` which hands the
+    underlying connection back to its pool once the body is exhausted.
+    """
+
+    def __init__(self, pool, host, conn, response, url):
+        self.pool, self.host, self.conn = pool, host, conn
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self._buffer = ''
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def _done(self):
+        """
+        Called once the response has been read completely.
+        """
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        if self.response.will_close:
+            conn.close()
+        else:
+            self.pool.release(self.host, conn)
+
+    def read(self, amt=None):
+        if self.conn is None and not self._buffer:
+            return ''
+        data, self._buffer = self._buffer, ''
+        if amt is None:
+            data += self.response.read()
+            self._done()
+            return data
+        if len(data) < amt:
+            chunk = self.response.read(amt - len(data))
+            if not chunk or self.response.isclosed():
+                self._done()
+            data += chunk
+        else:
+            data, self._buffer = data[:amt], data[amt:]
+        return data
+
+    def readline(self, limit=-1):
+        while '\n' not in self._buffer and self.conn is not None:
+            chunk = self.response.read(8192)
+            if not chunk or self.response.isclosed():
+                self._done()
+            self._buffer += chunk
+        pos = self._buffer.find('\n') + 1 or len(self._buffer)
+        if 0 <= limit < pos:
+            pos = limit
+        line, self._buffer = self._buffer[:pos], self._buffer[pos:]
+        return line
+
+    def close(self):
+        """
+        Closes response. If it has not been read completely, the connection
+        cannot be reused and will be closed, too.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self._buffer = ''
+
+class GzipStream (object):
+
+    """
+    File-like object decompressing a gzip-encoded stream on the fly. Only as
+    much of the underlying stream is read as needed, so the response can be
+    parsed while it is still being downloaded.
+    """
+
+    chunk_size = 16384
+
+    def __init__(self, fp):
+        self.fp = fp
+        # wbits offset 16 tells zlib to expect a gzip header and trailer
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size=-1):
+        if (size is None or size < 0) and not self._eof:
+            # decompress everything that is left in one go
+            self._buffer += (self._decompressor.decompress(self.fp.read())
+                             + self._decompressor.flush())
+            self._eof = True
+        while (size is None or size < 0 or len(self._buffer) < size) \
+        and not self._eof:
+            chunk = self.fp.read(self.chunk_size)
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+#: Connection pool shared by all API instances unless specified otherwise.
+DEFAULT_POOL = ConnectionPool()
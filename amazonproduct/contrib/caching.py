@@ -1,6 +1,6 @@
 import os
+from StringIO import StringIO
 import tempfile
-from lxml import etree
 
 try: # make it python2.4 compatible!
     from hashlib import md5
@@ -35,22 +35,34 @@ class ResponseCachingAPI (API):
             os.mkdir(self.cache)
 
     def _fetch(self, url):
-        if self.cache:
-            path = os.path.join(self.cache, '%s.xml' % self.get_hash(url))
-            # if response was fetched previously, use that one
-            if os.path.isfile(path):
-                return open(path)
+        # responses are stored as they are, HTTP errors (including 400 and 410
+        # which are handled by API._fetch_response) are not cached
+        if not self.cache:
+            return API._fetch(self, url)
+
+        path = os.path.join(self.cache, '%s.xml' % self.get_hash(url))
+        # if response was fetched previously, use that one
+        if os.path.isfile(path):
+            fp = open(path, 'rb')
+            try:
+                return StringIO(fp.read())
+            finally:
+                fp.close()
 
         # fetch original response from Amazon
-        resp = API._fetch(self, url)
+        fp = API._fetch(self, url)
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
 
-        if self.cache:
-            fp = open(path, 'w+')
-            fp.write(etree.tostring(etree.parse(resp), pretty_print=True))
-            fp.seek(0)
-            return fp
+        fp = open(path, 'wb')
+        try:
+            fp.write(data)
+        finally:
+            fp.close()
 
-        return resp
+        return StringIO(data)
 
     @staticmethod
     def get_hash(url):
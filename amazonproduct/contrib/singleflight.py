@@ -0,0 +1,76 @@
+import sys
+import threading
+
+from amazonproduct.api import API
+from amazonproduct.workers import Future
+
+class SingleFlightAPI (API):
+
+    """
+    This API makes sure that identical requests issued concurrently (e.g. by
+    several threads of a web application asking for the same ASIN) are only
+    sent to Amazon once. The first caller fetches the response, all others
+    wait for it and receive the same parsed result (or exception)::
+
+        api = SingleFlightAPI(AWS_KEY, SECRET_KEY, 'us')
+        # in several threads at once
+        root = api.item_lookup('0201896834')
+
+    Requests are considered identical if they have the same query parameters
+    (i.e. the URL excluding ``Timestamp`` and ``Signature``). Only requests
+    which are in flight at the same time are merged, nothing is cached.
+
+    .. note:: All callers share the very same result object. Do not modify it!
+    """
+
+    def __init__(self, access_key_id, secret_access_key, locale, **kwargs):
+        API.__init__(self, access_key_id, secret_access_key, locale, **kwargs)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    @staticmethod
+    def get_key(qargs):
+        """
+        Returns hashable key for a request based on its query parameters.
+        """
+        return tuple(sorted([(key, val) for key, val in qargs.items()
+            if val is not None and key not in ('Timestamp', 'Signature')]))
+
+    def call(self, **qargs):
+        key = self.get_key(qargs)
+        self._flights_lock.acquire()
+        try:
+            future = self._flights.get(key)
+            if future is None:
+                future = self._flights[key] = Future()
+                leader = True
+            else:
+                leader = False
+        finally:
+            self._flights_lock.release()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = API.call(self, **qargs)
+        except:
+            exc_info = sys.exc_info()
+            self._land(key)
+            future.set_exception(exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        self._land(key)
+        future.set_result(result)
+        return result
+
+    def _land(self, key):
+        """
+        Removes finished request from the ones in flight. Subsequent identical
+        requests will be sent to Amazon again.
+        """
+        self._flights_lock.acquire()
+        try:
+            del self._flights[key]
+        finally:
+            self._flights_lock.release()
@@ -1,3 +1,17 @@
+from collections import deque
+import os
+import cPickle as pickle
+import sys
+import tempfile
+import threading
+from Queue import Queue, Full
+
+try: # make it python2.4 compatible!
+    from hashlib import md5
+except ImportError: # pragma: no cover
+    from md5 import new as md5
+
+from amazonproduct.workers import WorkerPool
 
 class BaseResultPaginator (object):
 
@@ -21,37 +35,218 @@ class BaseResultPaginator (object):
                     SearchIndex='Books', ResponseGroup='Reviews', limit=10):
             print root.Review.AttributeOfInterest
 
+    Once the first page has told how many pages there are, the remaining
+    pages can be requested concurrently by passing ``prefetch`` (the number
+    of pages fetched ahead)::
+
+        for root in api.item_search('Books', Publisher='Galileo Press',
+                                    prefetch=4):
+            # ...
+
+    Pages are still yielded in order. All requests go through the rate
+    limiter of the API, so the combined rate will not exceed its limit.
+
+    If processing a page takes a while (e.g. writing it to a database),
+    ``read_ahead`` lets a background thread fetch the following pages one
+    after the other in the meantime. At most ``read_ahead`` pages are kept
+    waiting to be processed.
+
+    Rather than looping over the items of each page yourself, you can let
+    :meth:`iter_items` do it for you::
+
+        for asin, item in api.item_search('Books', Publisher='Galileo Press',
+                                          limit=10).iter_items():
+            print asin, item.ItemAttributes.Title
+
+    Long crawls can be resumed after they have been interrupted. Pass a store
+    for ``checkpoints`` (any mapping, e.g. a ``FileCheckpointStore``) and the
+    current position is saved after each page has been processed. Running
+    the same query again will continue after the last processed page (rather
+    than at page 1)::
+
+        store = FileCheckpointStore('/var/lib/crawler')
+        for root in api.item_search('Books', Publisher='Galileo Press',
+                                    checkpoints=store):
+            # ...
+
+    Alternatively, :meth:`checkpoint` returns the current position, which
+    can be passed on as ``resume`` to continue after it.
     """
 
+    #: response processor whose ``items()`` method is used by ``iter_items``
+    #: (set by ``paginate``)
+    processor = None
+
     def __init__(self, fun, args, kwargs, counter):
         """
         :param counter: counter variable passed to AWS.
         :param limit: limit fetched pages to this amount (restricted to a 
         maximum of 400 pages by API itself).
+        :param prefetch: number of pages which are fetched concurrently
+        ahead of the page being processed (``0`` fetches one page after the
+        other).
+        :param read_ahead: number of pages which a background thread fetches
+        (sequentially) ahead of the page being processed (cannot be combined
+        with ``prefetch``).
+        :param resume: checkpoint (as returned by :meth:`checkpoint`) after
+        which to continue.
+        :param checkpoints: mapping in which a checkpoint is stored after each
+        processed page (and from which it is resumed).
         """
         self.fun = fun
+        self.prefetch = kwargs.pop('prefetch', 0)
+        self.read_ahead = kwargs.pop('read_ahead', 0)
+        if self.prefetch > 0 and self.read_ahead > 0:
+            raise ValueError('Use either prefetch or read_ahead, not both!')
+        checkpoint = kwargs.pop('resume', None)
+        self.checkpoints = kwargs.pop('checkpoints', None)
         self.args, self.kwargs = args, kwargs
         self.counter = counter
         self.limit = kwargs.get('limit', 400)
 
-        # fetch first page to get pagination parameters
-        self._first_page = self.page(1)
+        self._first_page = None
+        self._resuming = False
+        if checkpoint is None and self.checkpoints is not None:
+            checkpoint = self.checkpoints.get(self.checkpoint_key())
+        if checkpoint is not None:
+            self.resume(checkpoint)
+        else:
+            # fetch first page to get pagination parameters
+            self._first_page = self.page(1)
 
     def __iter__(self):
         """
         Iterate over all paginated results of ``fun``.
         """
-        # return cached first page
-        yield self._first_page
+        if self._resuming:
+            # subsequent iterations start at the first page again
+            self._resuming = False
+        else:
+            # return first page (fetched to get the pagination parameters)
+            # only once so that it is not kept in memory for the whole
+            # iteration
+            root, self._first_page = self._first_page, None
+            if root is None:
+                root = self.page(1)
+            yield root
+            root = None
+            self._save_checkpoint()
+        if self.prefetch > 0:
+            pages = PagePrefetcher(self, self.prefetch)
+        elif self.read_ahead > 0:
+            pages = PageReader(self, self.read_ahead)
+        else:
+            pages = self._pages()
+        for root in pages:
+            yield root
+            root = None
+            self._save_checkpoint()
+        pages = None
+        # all pages are processed
+        if self.checkpoints is not None:
+            self.checkpoints.pop(self.checkpoint_key(), None)
+
+    def _pages(self):
+        """
+        Fetches the pages following the current one.
+        """
         while self.current < self.pages and self.current < self.limit:
             yield self.page(self.current + 1) 
 
+    def checkpoint(self):
+        """
+        Returns the current position as dictionary (which can be pickled or
+        serialised as JSON) containing the query as ``args`` and ``kwargs``
+        as well as the pagination data ``current`` (the last processed
+        page), ``pages`` and ``results``.
+        """
+        return {
+            'args' : list(self.args),
+            'kwargs' : self._query(),
+            'current' : self.current,
+            'pages' : self.pages,
+            'results' : self.results,
+        }
+
+    def resume(self, checkpoint):
+        """
+        Continues the next iteration after the page of ``checkpoint``.
+        Raises ``ValueError`` if the checkpoint belongs to another query.
+        """
+        if (list(checkpoint['args']) != list(self.args)
+        or checkpoint['kwargs'] != self._query()):
+            raise ValueError('Checkpoint does not match query!')
+        self.current = checkpoint['current']
+        self.pages = checkpoint['pages']
+        self.results = checkpoint['results']
+        self._first_page = None
+        self._resuming = True
+
+    def checkpoint_key(self):
+        """
+        Returns key under which the checkpoints of this query are stored.
+        """
+        query = (self.__class__.__name__, self.counter, list(self.args),
+                 sorted(self._query().items()))
+        return md5(repr(query)).hexdigest()
+
+    def _query(self):
+        query = dict(self.kwargs)
+        query.pop(self.counter, None)
+        return query
+
+    def _save_checkpoint(self):
+        if self.checkpoints is not None:
+            self.checkpoints[self.checkpoint_key()] = self.checkpoint()
+            # make sure persistent stores (e.g. shelve) write it to disk
+            if hasattr(self.checkpoints, 'sync'):
+                self.checkpoints.sync()
+
+    def iter_items(self):
+        """
+        Iterates over the items of all result pages and yields tuples
+        ``(ASIN, Item)``. Items which Amazon repeats on a later page are only
+        yielded once. Each page is let go as soon as all of its items have
+        been yielded, so only the ASINs seen so far are kept.
+        """
+        seen = set()
+        for root in self:
+            items = self.items(root)
+            root = None
+            for asin, item in items:
+                if asin not in seen:
+                    seen.add(asin)
+                    yield asin, item
+            items = item = None
+
+    def items(self, root):
+        """
+        Returns list of tuples ``(ASIN, Item)`` for all items of a result
+        page.
+        """
+        if self.processor is None:
+            raise TypeError('%s has no response processor to extract items '
+                'with (see attribute processor)' % self.__class__.__name__)
+        items = getattr(self.processor, 'items', None)
+        if items is None:
+            raise TypeError('%s does not support extracting items (method '
+                'items() is missing)' % self.processor.__class__.__name__)
+        return items(root)
+
+    def fetch(self, index):
+        """
+        Fetch single page from results without updating the pagination data
+        (so that several pages can be fetched at once).
+        """
+        kwargs = dict(self.kwargs)
+        kwargs[self.counter] = index
+        return self.fun(*self.args, **kwargs)
+
     def page(self, index):
         """
         Fetch single page from results.
         """
-        self.kwargs[self.counter] = index
-        root = self.fun(*self.args, **self.kwargs)
+        root = self.fetch(index)
         self.current, self.pages, self.results = self.extract_data(root)
         return root
         
@@ -62,6 +257,187 @@ class BaseResultPaginator (object):
         raise NotImplementedError
 
 
+class PagePrefetcher (object):
+
+    """
+    Iterates over the remaining pages of a paginator (following its current
+    page) which are fetched by ``window`` worker threads. At most ``window``
+    pages are requested ahead of the one being processed.
+    """
+
+    def __init__(self, paginator, window):
+        self.paginator = paginator
+        self.window = window
+        self.pool = WorkerPool(window)
+        self.futures = deque()
+        self.index = paginator.current + 1
+
+    def __iter__(self):
+        return self
+
+    def _schedule(self):
+        paginator = self.paginator
+        last = min(paginator.pages, paginator.limit)
+        while self.index <= last and len(self.futures) < self.window:
+            self.futures.append(self.pool.submit(paginator.fetch, self.index))
+            self.index += 1
+
+    def next(self):
+        self._schedule()
+        if not self.futures:
+            self.close()
+            raise StopIteration
+        try:
+            root = self.futures.popleft().result()
+        except:
+            # pages fetched further ahead are of no use any more
+            self.close()
+            raise
+        paginator = self.paginator
+        paginator.current, paginator.pages, paginator.results = \
+            paginator.extract_data(root)
+        # keep workers busy while this page is processed
+        self._schedule()
+        return root
+
+    def close(self):
+        """
+        Stops the worker threads (once the pages in flight are fetched).
+        """
+        self.index = self.paginator.limit + 1
+        self.futures.clear()
+        self.pool.shutdown(wait=False)
+
+    # stop workers if iteration is abandoned
+    __del__ = close
+
+
+class PageReader (object):
+
+    """
+    Iterates over the remaining pages of a paginator (following its current
+    page) which are fetched one after the other by a background thread. Up to
+    ``size`` fetched pages are queued until they are processed. Any exception
+    raised while fetching a page is re-raised in its place.
+    """
+
+    def __init__(self, paginator, size):
+        self.paginator = paginator
+        self.queue = Queue(size)
+        self.stopped = threading.Event()
+        self.done = False
+        # the thread must not keep a reference to the reader, otherwise an
+        # abandoned reader would never be stopped
+        thread = threading.Thread(target=_read_pages,
+                                  args=(paginator, self.queue, self.stopped))
+        thread.setDaemon(True)
+        thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.done:
+            raise StopIteration
+        item = self.queue.get()
+        if item is None:
+            self.done = True
+            raise StopIteration
+        root, data, exc_info = item
+        if exc_info is not None:
+            self.close()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        paginator = self.paginator
+        paginator.current, paginator.pages, paginator.results = data
+        return root
+
+    def close(self):
+        """
+        Stops the background thread (once the page in flight is fetched).
+        """
+        self.done = True
+        self.stopped.set()
+
+    # stop reading if iteration is abandoned
+    __del__ = close
+
+
+def _read_pages(paginator, queue, stopped):
+    """
+    Fetches all pages following the current one of ``paginator`` and puts
+    tuples ``(root, pagination data, exc_info)`` into ``queue`` (followed by
+    ``None``) until ``stopped`` is set.
+    """
+    def put(item):
+        while not stopped.isSet():
+            try:
+                queue.put(item, True, .1)
+                return True
+            except Full:
+                pass
+        return False
+
+    current, pages = paginator.current, paginator.pages
+    while current < pages and current < paginator.limit:
+        try:
+            root = paginator.fetch(current + 1)
+            data = paginator.extract_data(root)
+        except:
+            put((None, None, sys.exc_info()))
+            return
+        if not put((root, data, None)):
+            return
+        current, pages = data[0], data[1]
+    put(None)
+
+
+class FileCheckpointStore (object):
+
+    """
+    Stores paginator checkpoints in directory ``path`` (one pickled file per
+    query). Files are replaced atomically, so a crash while saving will leave
+    the previous checkpoint intact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _path(self, key):
+        return os.path.join(self.path, '%s.checkpoint' % key)
+
+    def get(self, key, default=None):
+        try:
+            fp = open(self._path(key), 'rb')
+        except IOError:
+            return default
+        try:
+            return pickle.load(fp)
+        finally:
+            fp.close()
+
+    def __setitem__(self, key, checkpoint):
+        fd, path = tempfile.mkstemp(dir=self.path)
+        fp = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump(checkpoint, fp, pickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+        if os.name == 'nt' and os.path.exists(self._path(key)):
+            # rename does not replace existing files on Windows
+            os.remove(self._path(key)) # pragma: no cover
+        os.rename(path, self._path(key))
+
+    def pop(self, key, default=None):
+        checkpoint = self.get(key, default)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+        return checkpoint
+
+
 def paginate(fnc):
     """
     Paginates over result pages by iteratively calling decorated method with
@@ -69,13 +445,16 @@ def paginate(fnc):
     """
     def wrapped(api, *args, **kwargs):
         processor = api.response_processor
-        try:
-            # try to return the OPERATION_paginator from API instance
-            klass = getattr(processor, '%s_paginator' % fnc.__name__)
-            method = lambda *a, **b: fnc(api, *a, **b)
-            return klass(method, *args, **kwargs)
-        except AttributeError:
+        # try to return the OPERATION_paginator from API instance
+        klass = getattr(processor, '%s_paginator' % fnc.__name__, None)
+        if klass is None:
             return fnc(api, *args, **kwargs)
+        method = lambda *a, **b: fnc(api, *a, **b)
+        paginator = klass(method, *args, **kwargs)
+        paginator.processor = processor
+        return paginator
+    wrapped.__name__ = fnc.__name__
+    wrapped.__doc__ = fnc.__doc__
     return wrapped
 
 
@@ -96,17 +475,24 @@ class LxmlPaginator (BaseResultPaginator):
         super(LxmlPaginator, self).__init__(fun, args, kwargs, self.counter)
 
     def extract_data(self, root):
+        # imported here (processors imports this module)
+        from amazonproduct.processors import compile_xpath
+        root = getattr(root, 'root', root) # unwrap LazyResponse
         nspace = root.nsmap.get(None, '')
         values = []
         def fetch_value(xpath, default):
             try:
-                node = root.xpath(xpath, namespaces={'aws' : nspace})[0]
-                return node.pyval
+                node = compile_xpath(nspace, xpath)(root)[0]
+                value = node.pyval
             except AttributeError:
                 # node has no attribute pyval so it better be a number
                 return int(node)
             except IndexError:
                 return default
+            if not isinstance(value, (int, long)):
+                # e.g. <VariationPage>All</VariationPage>
+                return default
+            return value
         return map(lambda a: fetch_value(*a), [
             (self.current_page_xpath, 1),
             (self.total_pages_xpath, 0),
@@ -133,3 +519,140 @@ class LxmlItemSearchPaginator (LxmlPaginator):
             kwargs['limit'] = 5
         super(LxmlItemSearchPaginator, self).__init__(fnc, *args, **kwargs)
 
+
+# Paginators for ItemLookup responses. The page counts are found in the same
+# location in all supported API versions (2009-10-01 to 2010-12-01). Responses
+# without them (e.g. reviews as IFrameURL) are treated as a single page.
+
+class LxmlReviewPaginator (LxmlPaginator):
+
+    counter = 'ReviewPage'
+    current_page_xpath = '//aws:Items/aws:Request/aws:ItemLookupRequest/aws:ReviewPage'
+    total_pages_xpath = '//aws:Items/aws:Item/aws:CustomerReviews/aws:TotalReviewPages'
+    total_results_xpath = '//aws:Items/aws:Item/aws:CustomerReviews/aws:TotalReviews'
+
+
+class LxmlOfferPaginator (LxmlPaginator):
+
+    counter = 'OfferPage'
+    current_page_xpath = '//aws:Items/aws:Request/aws:ItemLookupRequest/aws:OfferPage'
+    total_pages_xpath = '//aws:Items/aws:Item/aws:Offers/aws:TotalOfferPages'
+    total_results_xpath = '//aws:Items/aws:Item/aws:Offers/aws:TotalOffers'
+
+
+class LxmlVariationPaginator (LxmlPaginator):
+
+    counter = 'VariationPage'
+    current_page_xpath = '//aws:Items/aws:Request/aws:ItemLookupRequest/aws:VariationPage'
+    total_pages_xpath = '//aws:Items/aws:Item/aws:Variations/aws:TotalVariationPages'
+    total_results_xpath = '//aws:Items/aws:Item/aws:Variations/aws:TotalVariations'
+
+
+class LxmlEtreePaginator (LxmlPaginator):
+
+    """
+    Result paginator for plain ``lxml.etree`` trees (as returned by
+    ``LxmlEtreeProcessor``). The XPath expressions are compiled once for each
+    API version (i.e. XML namespace).
+    """
+
+    def _xpaths(self, nspace):
+        # imported here (processors imports this module)
+        from amazonproduct.processors import compile_xpath
+        return [compile_xpath(nspace, xpath, smart_strings=False)
+                for xpath in (self.current_page_xpath, self.total_pages_xpath,
+                              self.total_results_xpath)]
+
+    def extract_data(self, root):
+        root = getattr(root, 'root', root) # unwrap LazyResponse
+        nspace = root.nsmap.get(None, '')
+        values = []
+        for xpath, default in zip(self._xpaths(nspace), (1, 0, 0)):
+            result = xpath(root)
+            if not result:
+                values.append(default)
+                continue
+            # XPath expressions can return attribute values, too
+            node = result[0]
+            try:
+                values.append(int(getattr(node, 'text', node)))
+            except ValueError:
+                # e.g. <VariationPage>All</VariationPage>
+                values.append(default)
+        return values
+
+
+class LxmlEtreeItemSearchPaginator (LxmlEtreePaginator,
+                                    LxmlItemSearchPaginator):
+    pass
+
+
+class LxmlEtreeReviewPaginator (LxmlEtreePaginator, LxmlReviewPaginator):
+    pass
+
+
+class LxmlEtreeOfferPaginator (LxmlEtreePaginator, LxmlOfferPaginator):
+    pass
+
+
+class LxmlEtreeVariationPaginator (LxmlEtreePaginator,
+                                   LxmlVariationPaginator):
+    pass
+
+
+class ExpatPaginator (LxmlPaginator):
+
+    """
+    Result paginator for ``ElementTree`` trees (as returned by
+    ``ExpatProcessor``). Page and result information is located with simple
+    paths relative to the root node (like ``Items/TotalPages``).
+    """
+
+    current_page_path = None
+    total_pages_path = None
+    total_results_path = None
+
+    def extract_data(self, root):
+        # imported here (processors imports this module)
+        from amazonproduct.processors import qualify
+        root = getattr(root, 'root', root) # unwrap LazyResponse
+        nspace = root.tag[:root.tag.find('}')+1]
+        values = []
+        for path, default in [(self.current_page_path, 1),
+                              (self.total_pages_path, 0),
+                              (self.total_results_path, 0)]:
+            text = root.findtext(qualify(nspace, path))
+            try:
+                values.append(int(text))
+            except (TypeError, ValueError):
+                # missing or e.g. <VariationPage>All</VariationPage>
+                values.append(default)
+        return values
+
+
+class ExpatItemSearchPaginator (ExpatPaginator, LxmlItemSearchPaginator):
+
+    current_page_path = 'Items/Request/ItemSearchRequest/ItemPage'
+    total_pages_path = 'Items/TotalPages'
+    total_results_path = 'Items/TotalResults'
+
+
+class ExpatReviewPaginator (ExpatPaginator, LxmlReviewPaginator):
+
+    current_page_path = 'Items/Request/ItemLookupRequest/ReviewPage'
+    total_pages_path = 'Items/Item/CustomerReviews/TotalReviewPages'
+    total_results_path = 'Items/Item/CustomerReviews/TotalReviews'
+
+
+class ExpatOfferPaginator (ExpatPaginator, LxmlOfferPaginator):
+
+    current_page_path = 'Items/Request/ItemLookupRequest/OfferPage'
+    total_pages_path = 'Items/Item/Offers/TotalOfferPages'
+    total_results_path = 'Items/Item/Offers/TotalOffers'
+
+
+class ExpatVariationPaginator (ExpatPaginator, LxmlVariationPaginator):
+
+    current_page_path = 'Items/Request/ItemLookupRequest/VariationPage'
+    total_pages_path = 'Items/Item/Variations/TotalVariationPages'
+    total_results_path = 'Items/Item/Variations/TotalVariations'
@@ -1,6 +1,209 @@
 
+from StringIO import StringIO
+
 from amazonproduct.errors import AWSError
 from amazonproduct.paginators import LxmlItemSearchPaginator
+from amazonproduct.paginators import LxmlReviewPaginator
+from amazonproduct.paginators import LxmlOfferPaginator
+from amazonproduct.paginators import LxmlVariationPaginator
+from amazonproduct.paginators import LxmlEtreeItemSearchPaginator
+from amazonproduct.paginators import LxmlEtreeReviewPaginator
+from amazonproduct.paginators import LxmlEtreeOfferPaginator
+from amazonproduct.paginators import LxmlEtreeVariationPaginator
+from amazonproduct.paginators import ExpatItemSearchPaginator
+from amazonproduct.paginators import ExpatReviewPaginator
+from amazonproduct.paginators import ExpatOfferPaginator
+from amazonproduct.paginators import ExpatVariationPaginator
+
+#: Errors can only occur for the whole request (directly below the root node)
+#: or within the request echo of a result container (e.g. ``Items``).
+ERRORS_XPATH = 'aws:Error | */aws:Request/aws:Errors/aws:Error'
+
+#: Same for multi-operation requests (which have one more level).
+MULTI_OPERATION_ERRORS_XPATH = ('aws:Error | '
+    '*/aws:Error | */*/aws:Request/aws:Errors/aws:Error')
+
+_compiled = {}
+
+def compile_xpath(nspace, xpath, smart_strings=True):
+    """
+    Returns XPath expression ``xpath`` (using prefix ``aws`` for namespace
+    ``nspace``) compiled only once.
+
+    :param smart_strings: if ``False``, text results are plain strings which
+      do not keep a reference to their element (and are faster to create).
+    """
+    key = (nspace, xpath, smart_strings)
+    try:
+        return _compiled[key]
+    except KeyError:
+        from lxml import etree
+        compiled = _compiled[key] = etree.XPath(xpath,
+            namespaces={'aws' : nspace}, smart_strings=smart_strings)
+        return compiled
+
+def as_string(data):
+    """
+    Returns ``data`` (a string, ``buffer``, ``bytearray`` or ``memoryview``)
+    as string which is the only type ``lxml`` can parse. Strings are returned
+    as they are without being copied.
+    """
+    if isinstance(data, basestring):
+        return data
+    if hasattr(data, 'tobytes'): # memoryview
+        return data.tobytes()
+    return str(data)
+
+_qualified = {}
+
+def qualify(nspace, path):
+    """
+    Returns ElementTree ``path`` with all tag names (except wildcards)
+    qualified with namespace ``nspace`` (e.g. ``{http://...}``). Each path is
+    only built once.
+    """
+    try:
+        return _qualified[nspace, path]
+    except KeyError:
+        qualified = _qualified[nspace, path] = '/'.join(
+            [name != '*' and nspace + name or name
+             for name in path.split('/')])
+        return qualified
+
+def find_errors(root):
+    """
+    Returns all ``Error`` nodes in response ``root``. Only those parts of the
+    response are searched which can actually contain errors (instead of
+    scanning the whole tree with ``//aws:Error``).
+    """
+    nspace = root.nsmap.get(None, '')
+    if root.tag == '{%s}MultiOperationResponse' % nspace:
+        return compile_xpath(nspace, MULTI_OPERATION_ERRORS_XPATH)(root)
+    return compile_xpath(nspace, ERRORS_XPATH)(root)
+
+
+class LxmlNodes (object):
+
+    """
+    Node access used by ``split_response`` for ``lxml`` trees (both
+    ``lxml.objectify`` and ``lxml.etree``). Paths are simple ElementTree paths
+    relative to the node (like ``Request/Errors/Error``).
+    """
+
+    def namespace(self, node):
+        """
+        Returns namespace of ``node`` as tag prefix (e.g. ``{http://...}``).
+        """
+        return '{%s}' % node.nsmap.get(None, '')
+
+    def children(self, node):
+        """
+        Returns list of all child nodes.
+        """
+        return list(node.iterchildren())
+
+    def findall(self, node, path):
+        """
+        Returns list of all nodes matching ``path``.
+        """
+        return compile_xpath(node.nsmap.get(None, ''), qualify('aws:', path),
+                             smart_strings=False)(node)
+
+    def findtext(self, node, path):
+        """
+        Returns text of first node matching ``path`` (or ``None``).
+        """
+        return node.findtext(qualify(self.namespace(node), path))
+
+    def error(self, node):
+        """
+        Returns ``AWSError`` for ``Error`` node.
+        """
+        return AWSError(self.findtext(node, 'Code'),
+                        self.findtext(node, 'Message'))
+
+    def root(self, root, tag):
+        """
+        Returns new (empty) root node with name ``tag``.
+        """
+        return root.makeelement(tag, nsmap=root.nsmap)
+
+
+class ElementTreeNodes (LxmlNodes):
+
+    """
+    Node access used by ``split_response`` for ``ElementTree`` trees.
+    """
+
+    def namespace(self, node):
+        return node.tag[:node.tag.find('}')+1]
+
+    def children(self, node):
+        return list(node)
+
+    def findall(self, node, path):
+        return node.findall(qualify(self.namespace(node), path))
+
+    def root(self, root, tag):
+        return root.makeelement(tag, {})
+
+
+def split_response(root, nodes):
+    """
+    Splits the response to a batch or multi-operation request and returns a
+    list of tuples ``(operation, result)`` in the order of the requests. Each
+    ``result`` is either a root node which looks just like the response to a
+    single request or an ``AWSError`` if this particular request failed.
+    Errors for the whole request (e.g. an invalid signature) are raised.
+
+    :param nodes: ``LxmlNodes`` or ``ElementTreeNodes`` matching the tree.
+    """
+    prefix = nodes.namespace(root)
+    for error in nodes.findall(root, 'Error'):
+        raise nodes.error(error)
+
+    if root.tag == prefix + 'MultiOperationResponse':
+        responses = [node for node in nodes.children(root)
+                     if node.tag.endswith('Response')]
+    else:
+        responses = [root]
+
+    results = []
+    for response in responses:
+        operation = response.tag[len(prefix):-len('Response')]
+        for container in nodes.children(response):
+            if container.tag == prefix + 'OperationRequest':
+                continue
+            errors = nodes.findall(container, 'Request/Errors/Error')
+            if errors:
+                result = nodes.error(errors[0])
+            else:
+                # move result into a root node of its own
+                result = nodes.root(root, response.tag)
+                result.append(container)
+            results.append((operation, result))
+    return results
+
+
+def split_items(root, nodes):
+    """
+    Returns tuple ``(items, errors)`` for an ``ItemLookup`` response with a
+    list of tuples ``(ASIN, Item)`` and a list of ``AWSError``s for all errors
+    reported for the request (e.g. one for each invalid item id). Unlike
+    parsing the response as usual, the items are returned even if some of the
+    ids failed. Errors for the whole request are raised.
+
+    :param nodes: ``LxmlNodes`` or ``ElementTreeNodes`` matching the tree.
+    """
+    for error in nodes.findall(root, 'Error'):
+        raise nodes.error(error)
+    items, errors = [], []
+    for container in nodes.findall(root, 'Items'):
+        errors.extend([nodes.error(error) for error
+                       in nodes.findall(container, 'Request/Errors/Error')])
+        items.extend([(nodes.findtext(item, 'ASIN'), item)
+                      for item in nodes.findall(container, 'Item')])
+    return items, errors
 
 class LxmlObjectifyProcessor (object):
 
@@ -38,25 +241,377 @@ class LxmlObjectifyProcessor (object):
         # provide a parse method to avoid importing lxml.objectify
         # every time this processor is called
         self.parse = lambda fp: objectify.parse(fp, parser)
+        self._fromstring = lambda data: objectify.fromstring(data, parser)
 
     def __call__(self, fp):
         """
         Parses a file-like object containing the Amazon XML response.
         """
         tree = self.parse(fp)
-        root = tree.getroot()
+        return self._check(tree.getroot())
+
+    def fromstring(self, data):
+        """
+        Parses the Amazon XML response contained in a string (or any other
+        buffer like a ``memoryview``). The parser is reused.
+        """
+        return self._check(self._fromstring(as_string(data)))
 
+    def _check(self, root):
+        """
+        Raises ``AWSError`` if response ``root`` contains an error.
+        """
         #~ from lxml import etree
-        #~ print etree.tostring(tree, pretty_print=True)
+        #~ print etree.tostring(root, pretty_print=True)
 
-        nspace = root.nsmap.get(None, '')
-        errors = root.xpath('//aws:Error',
-                         namespaces={'aws' : nspace})
-        for error in errors:
+        for error in find_errors(root):
             code = error.Code.text
             msg = error.Message.text
             raise AWSError(code, msg)
 
         return root
 
+    def split(self, fp):
+        """
+        Parses the response to a batch or multi-operation request and returns
+        a list of tuples ``(operation, result)`` in the order of the requests
+        (see ``split_response``).
+        """
+        return split_response(self.parse(fp).getroot(), LxmlNodes())
+
+    def items(self, root):
+        """
+        Returns list of tuples ``(ASIN, Item)`` for all items contained in an
+        ``ItemLookup`` or ``ItemSearch`` response.
+        """
+        root = getattr(root, 'root', root) # unwrap LazyResponse
+        nspace = root.nsmap.get(None, '')
+        return [(item.ASIN.text, item) for item in compile_xpath(
+            nspace, '//aws:Items/aws:Item')(root)]
+
+    def split_items(self, fp):
+        """
+        Parses an ``ItemLookup`` response and returns its items along with
+        the errors reported for single ids (see ``split_items``).
+        """
+        return split_items(self.parse(fp).getroot(), LxmlNodes())
+
     item_search_paginator = LxmlItemSearchPaginator
+    item_reviews_paginator = LxmlReviewPaginator
+    item_offers_paginator = LxmlOfferPaginator
+    item_variations_paginator = LxmlVariationPaginator
+
+
+class LxmlEtreeProcessor (object):
+
+    """
+    Response processor using plain ``lxml.etree``. It skips objectify's
+    element class lookup and type guessing and is thus considerably faster.
+    All XPath expressions are compiled once for each API version (i.e. XML
+    namespace) and can use prefix ``aws``::
+
+        processor = LxmlEtreeProcessor()
+        api = API(AWS_KEY, SECRET_KEY, 'us', processor=processor)
+        root = api.item_lookup('0201896834', ResponseGroup='SalesRank')
+        for item in processor.xpath(root, '//aws:Items/aws:Item'):
+            print processor.get_text(item, 'aws:ItemAttributes/aws:Title'),
+            print processor.get_int(item, 'aws:SalesRank')
+
+    Result paginators are supported, too.
+    """
+
+    ITEMS = '//aws:Items/aws:Item'
+
+    def __init__(self):
+        from lxml import etree
+        parser = etree.XMLParser()
+        self.parse = lambda fp: etree.parse(fp, parser)
+        self._fromstring = lambda data: etree.fromstring(data, parser)
+
+    def compile(self, nspace, xpath):
+        """
+        Returns compiled XPath expression for namespace ``nspace`` (see
+        ``compile_xpath``).
+        """
+        return compile_xpath(nspace, xpath, smart_strings=False)
+
+    def xpath(self, node, xpath):
+        """
+        Evaluates XPath expression ``xpath`` with ``node`` as context node.
+        """
+        nspace = node.nsmap.get(None, '')
+        return self.compile(nspace, xpath)(node)
+
+    def get_text(self, node, xpath, default=None):
+        """
+        Returns text of the first node matching ``xpath`` (or ``default`` if
+        there is none).
+        """
+        result = self.xpath(node, xpath)
+        if not result:
+            return default
+        # XPath expressions can return attribute values and text, too
+        return getattr(result[0], 'text', result[0])
+
+    def get_int(self, node, xpath, default=None):
+        """
+        Returns value of the first node matching ``xpath`` as ``int``.
+        """
+        text = self.get_text(node, xpath)
+        if text is None:
+            return default
+        return int(text)
+
+    def get_float(self, node, xpath, default=None):
+        """
+        Returns value of the first node matching ``xpath`` as ``float``.
+        """
+        text = self.get_text(node, xpath)
+        if text is None:
+            return default
+        return float(text)
+
+    def get_bool(self, node, xpath, default=None):
+        """
+        Returns value of the first node matching ``xpath`` as ``bool``
+        (Amazon uses ``True`` and ``False``).
+        """
+        text = self.get_text(node, xpath)
+        if text is None:
+            return default
+        return text.strip().lower() in ('true', '1')
+
+    def _error(self, error):
+        return AWSError(self.get_text(error, 'aws:Code'),
+                        self.get_text(error, 'aws:Message'))
+
+    def __call__(self, fp):
+        """
+        Parses a file-like object containing the Amazon XML response.
+        """
+        return self._check(self.parse(fp).getroot())
+
+    def fromstring(self, data):
+        """
+        Parses the Amazon XML response contained in a string (or any other
+        buffer like a ``memoryview``). The parser is reused.
+        """
+        return self._check(self._fromstring(as_string(data)))
+
+    def _check(self, root):
+        for error in find_errors(root):
+            raise self._error(error)
+        return root
+
+    def split(self, fp):
+        """
+        Parses the response to a batch or multi-operation request (see
+        ``split_response``).
+        """
+        return split_response(self.parse(fp).getroot(), LxmlNodes())
+
+    def items(self, root):
+        """
+        Returns list of tuples ``(ASIN, Item)`` for all items contained in an
+        ``ItemLookup`` or ``ItemSearch`` response.
+        """
+        root = getattr(root, 'root', root) # unwrap LazyResponse
+        return [(self.get_text(item, 'aws:ASIN'), item)
+                for item in self.xpath(root, self.ITEMS)]
+
+    def split_items(self, fp):
+        """
+        Parses an ``ItemLookup`` response and returns its items along with
+        the errors reported for single ids (see ``split_items``).
+        """
+        return split_items(self.parse(fp).getroot(), LxmlNodes())
+
+    item_search_paginator = LxmlEtreeItemSearchPaginator
+    item_reviews_paginator = LxmlEtreeReviewPaginator
+    item_offers_paginator = LxmlEtreeOfferPaginator
+    item_variations_paginator = LxmlEtreeVariationPaginator
+
+
+class LxmlIterparseProcessor (object):
+
+    """
+    Streaming response processor using ``lxml.etree.iterparse``. Instead of
+    the root node it returns an iterator over all ``Items/Item`` elements of
+    the response (as plain ``lxml.etree`` elements). Each item is yielded as
+    soon as it has been parsed and cleared again once the iteration moves on,
+    so memory use stays flat even for large responses (e.g. with response
+    groups ``Large``, ``OfferFull`` or ``Variations``)::
+
+        api = API(AWS_KEY, SECRET_KEY, 'us',
+                  processor=LxmlIterparseProcessor())
+        for item in api.item_lookup(','.join(asins), ResponseGroup='Large'):
+            print item.findtext('{*}ItemAttributes/{*}Title')
+
+    Errors are reported in the response before any item, the parser reads up
+    to the first item before returning the iterator. This way ``AWSError``s
+    are raised by the API call itself (and converted to more specific
+    exceptions as usual).
+
+    .. warning:: Items are emptied after they have been yielded. Copy the
+       data you need (or use ``copy.deepcopy(item)``) before advancing!
+
+    This processor does not support paginators.
+    """
+
+    def __init__(self):
+        from lxml import etree
+        self.iterparse = etree.iterparse
+
+    def __call__(self, fp):
+        """
+        Parses a file-like object containing the Amazon XML response and
+        returns an iterator over its items.
+        """
+        items = self._iterate(fp)
+        try:
+            first = items.next()
+        except StopIteration:
+            return iter([])
+        return self._chain(first, items)
+
+    def fromstring(self, data):
+        """
+        Returns an iterator over the items of the Amazon XML response
+        contained in a string (or any other buffer like a ``memoryview``).
+        """
+        return self(StringIO(as_string(data)))
+
+    def _chain(self, first, items):
+        yield first
+        for item in items:
+            yield item
+
+    def _iterate(self, fp):
+        for event, elem in self.iterparse(fp, events=('end', )):
+            name = elem.tag[elem.tag.find('}')+1:]
+            if name == 'Error':
+                nspace = elem.nsmap.get(None, '')
+                raise AWSError(elem.findtext('{%s}Code' % nspace),
+                               elem.findtext('{%s}Message' % nspace))
+            if name != 'Item':
+                continue
+            parent = elem.getparent()
+            if not parent.tag.endswith('}Items'):
+                # nested items (e.g. variations) are part of their parent
+                continue
+            # free memory of all previously parsed siblings
+            while elem.getprevious() is not None:
+                del parent[0]
+            yield elem
+            elem.clear()
+
+    def items(self, items):
+        """
+        Returns list of tuples ``(ASIN, Item)`` for all items returned by
+        this processor. Items are copied so that they remain intact.
+        """
+        from copy import deepcopy
+        result = []
+        for item in items:
+            nspace = item.nsmap.get(None, '')
+            result.append((item.findtext('{%s}ASIN' % nspace),
+                           deepcopy(item)))
+        return result
+
+
+
+class ExpatProcessor (object):
+
+    """
+    Response processor which only needs the standard library (for
+    environments where ``lxml`` cannot be installed). The response is parsed
+    with ``xml.etree.cElementTree`` which builds the tree directly from the
+    callbacks of the ``expat`` parser in C (and is within 2x of
+    ``lxml.etree``). If the C module is not available, the pure Python
+    ``xml.etree.ElementTree`` is used.
+
+    Nodes are plain ``ElementTree`` elements and tag names include the
+    namespace. Use ``path()`` to build paths for ``find()``, ``findall()``
+    and ``findtext()``::
+
+        processor = ExpatProcessor()
+        api = API(AWS_KEY, SECRET_KEY, 'us', processor=processor)
+        root = api.item_lookup('0201896834')
+        print root.findtext(processor.path(root,
+                            'Items/Item/ItemAttributes/Title'))
+
+    Result paginators are supported, too.
+    """
+
+    def __init__(self):
+        try:
+            from xml.etree import cElementTree as etree
+        except ImportError: # pragma: no cover
+            from xml.etree import ElementTree as etree
+        self.parse = etree.parse
+        self._fromstring = etree.fromstring
+
+    def path(self, node, path):
+        """
+        Returns ``path`` (tag names separated by slashes) with all tag names
+        qualified with the namespace of ``node``.
+        """
+        return qualify(node.tag[:node.tag.find('}')+1], path)
+
+    def __call__(self, fp):
+        """
+        Parses a file-like object containing the Amazon XML response.
+        """
+        return self._check(self.parse(fp).getroot())
+
+    def fromstring(self, data):
+        """
+        Parses the Amazon XML response contained in a string (or any other
+        buffer like a ``memoryview``).
+        """
+        return self._check(self._fromstring(as_string(data)))
+
+    def _error(self, error):
+        return AWSError(error.findtext(self.path(error, 'Code')),
+                        error.findtext(self.path(error, 'Message')))
+
+    def _check(self, root):
+        # errors for the whole request or in the request echo of a container
+        # (which is one level deeper in multi-operation responses, just like
+        # with ``find_errors``)
+        paths = ('Error', '*/Request/Errors/Error')
+        if root.tag == self.path(root, 'MultiOperationResponse'):
+            paths = ('Error', '*/Error', '*/*/Request/Errors/Error')
+        for path in paths:
+            for error in root.findall(self.path(root, path)):
+                raise self._error(error)
+        return root
+
+    def split(self, fp):
+        """
+        Parses the response to a batch or multi-operation request (see
+        ``split_response``).
+        """
+        return split_response(self.parse(fp).getroot(), ElementTreeNodes())
+
+    def items(self, root):
+        """
+        Returns list of tuples ``(ASIN, Item)`` for all items contained in an
+        ``ItemLookup`` or ``ItemSearch`` response.
+        """
+        root = getattr(root, 'root', root) # unwrap LazyResponse
+        asin = self.path(root, 'ASIN')
+        return [(item.findtext(asin), item)
+                for item in root.findall(self.path(root, 'Items/Item'))]
+
+    def split_items(self, fp):
+        """
+        Parses an ``ItemLookup`` response and returns its items along with
+        the errors reported for single ids (see ``split_items``).
+        """
+        return split_items(self.parse(fp).getroot(), ElementTreeNodes())
+
+    item_search_paginator = ExpatItemSearchPaginator
+    item_reviews_paginator = ExpatReviewPaginator
+    item_offers_paginator = ExpatOfferPaginator
+    item_variations_paginator = ExpatVariationPaginator
@@ -0,0 +1,157 @@
+# Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Compact records extracted from ``ItemLookup`` and ``ItemSearch`` responses.
+Keeping the complete XML tree of an item in memory costs several kilobytes.
+If you only need a few of its attributes (for instance to compare large parts
+of a catalogue), extract them into ``ItemRecord``s and let the tree go::
+
+    extract = ItemExtractor()
+    records = {}
+    for root in api.item_search('Books', Publisher='Galileo Press',
+                                ResponseGroup='Large'):
+        for record in extract(root):
+            records[record.asin] = record
+
+This works with trees of both ``LxmlObjectifyProcessor`` and
+``LxmlEtreeProcessor`` as well as with items yielded by
+``LxmlIterparseProcessor`` (using ``ItemExtractor.record()``).
+"""
+
+from amazonproduct.processors import compile_xpath
+
+class ItemRecord (object):
+
+    """
+    Immutable, picklable and comparable record of the most commonly used item
+    attributes. Prices are tuples ``(amount, currency)`` with the amount in
+    the smallest unit of the currency (e.g. cents). All attributes which are
+    not contained in the response are ``None`` (or an empty tuple for
+    ``browse_nodes``).
+    """
+
+    __slots__ = ('asin', 'title', 'binding', 'list_price', 'lowest_new_price',
+                 'lowest_used_price', 'sales_rank', 'small_image',
+                 'medium_image', 'large_image', 'browse_nodes')
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self.__slots__):
+            raise TypeError('ItemRecord takes at most %i arguments (%i given)'
+                            % (len(self.__slots__), len(args)))
+        values = dict(zip(self.__slots__, args))
+        for key, val in kwargs.items():
+            if key not in self.__slots__:
+                raise TypeError('Unknown attribute %r' % key)
+            if key in values:
+                raise TypeError('Multiple values for attribute %r' % key)
+            values[key] = val
+        for key in self.__slots__:
+            object.__setattr__(self, key, values.get(key))
+        if self.browse_nodes is None:
+            object.__setattr__(self, 'browse_nodes', ())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ItemRecord is read-only!')
+
+    def astuple(self):
+        """
+        Returns all attribute values (in the order of ``__slots__``).
+        """
+        return tuple([getattr(self, key) for key in self.__slots__])
+
+    # slotted objects cannot be pickled with protocols 0 and 1 otherwise
+    def __reduce__(self):
+        return (self.__class__, self.astuple())
+
+    def __eq__(self, other):
+        if not isinstance(other, ItemRecord):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __ne__(self, other):
+        if not isinstance(other, ItemRecord):
+            return NotImplemented
+        return self.astuple() != other.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return '<ItemRecord %s %r>' % (self.asin, self.title)
+
+
+class ItemExtractor (object):
+
+    """
+    Extracts ``ItemRecord``s from XML responses using XPath expressions which
+    are compiled once for each API version (i.e. XML namespace).
+    """
+
+    ITEMS = '//aws:Items/aws:Item'
+
+    #: XPath expressions (relative to the item) for text attributes
+    TEXT = [
+        ('asin', 'aws:ASIN/text()'),
+        ('title', 'aws:ItemAttributes/aws:Title/text()'),
+        ('binding', 'aws:ItemAttributes/aws:Binding/text()'),
+        ('sales_rank', 'aws:SalesRank/text()'),
+        ('small_image', 'aws:SmallImage/aws:URL/text()'),
+        ('medium_image', 'aws:MediumImage/aws:URL/text()'),
+        ('large_image', 'aws:LargeImage/aws:URL/text()'),
+    ]
+
+    #: XPath expressions (relative to the item) for price elements
+    PRICES = [
+        ('list_price', 'aws:ItemAttributes/aws:ListPrice'),
+        ('lowest_new_price', 'aws:OfferSummary/aws:LowestNewPrice'),
+        ('lowest_used_price', 'aws:OfferSummary/aws:LowestUsedPrice'),
+    ]
+
+    BROWSE_NODES = 'aws:BrowseNodes/aws:BrowseNode/aws:BrowseNodeId/text()'
+    AMOUNT = 'aws:Amount/text()'
+    CURRENCY = 'aws:CurrencyCode/text()'
+
+    def _xpaths(self, nspace):
+        def compile(xpath):
+            return compile_xpath(nspace, xpath, smart_strings=False)
+        return (
+            compile(self.ITEMS),
+            [(key, compile(xpath)) for key, xpath in self.TEXT],
+            [(key, compile(xpath)) for key, xpath in self.PRICES],
+            compile(self.BROWSE_NODES),
+            compile(self.AMOUNT),
+            compile(self.CURRENCY),
+        )
+
+    def __call__(self, root):
+        """
+        Returns list of ``ItemRecord``s for all items in response ``root``.
+        """
+        items = self._xpaths(root.nsmap.get(None, ''))[0]
+        return [self.record(item) for item in items(root)]
+
+    def record(self, item):
+        """
+        Returns ``ItemRecord`` for a single ``Item`` element.
+        """
+        _, text, prices, browse_nodes, amount, currency = self._xpaths(
+            item.nsmap.get(None, ''))
+        values = {}
+        for key, xpath in text:
+            result = xpath(item)
+            if result:
+                values[key] = result[0]
+        if 'sales_rank' in values:
+            values['sales_rank'] = int(values['sales_rank'])
+        for key, xpath in prices:
+            for price in xpath(item):
+                # some prices are "too low to display" and have no amount
+                value, code = amount(price), currency(price)
+                if value:
+                    values[key] = (int(value[0]), code and code[0] or None)
+                break
+        values['browse_nodes'] = tuple(browse_nodes(item))
+        return ItemRecord(**values)
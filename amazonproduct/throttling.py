@@ -0,0 +1,268 @@
+# Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Rate limiters keeping requests within the limits imposed by Amazon.
+
+A rate limiter is any object with a method ``acquire()`` which blocks until
+the next request may be sent. ``API`` calls it before every request.
+Optionally, it can provide methods ``success()`` and ``throttled()`` which are
+called after each successful request and after each request Amazon rejected
+with HTTP 503 (see ``AdaptiveRateLimiter``).
+"""
+
+import os
+import random
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # pragma: no cover
+    fcntl = None
+
+# time.monotonic only exists in Python 3.3+, so on all supported versions
+# (2.4 to 2.7) the fallback below is used
+try:
+    from time import monotonic
+except ImportError:
+    _clock_lock = threading.Lock()
+    _clock_state = {'last' : 0.0, 'offset' : 0.0}
+    def monotonic():
+        """
+        Wall clock time which never runs backwards (even if the system clock
+        is set back).
+        """
+        _clock_lock.acquire()
+        try:
+            now = time.time() + _clock_state['offset']
+            if now < _clock_state['last']:
+                _clock_state['offset'] += _clock_state['last'] - now
+                now = _clock_state['last']
+            _clock_state['last'] = now
+            return now
+        finally:
+            _clock_lock.release()
+
+class TokenBucket (object):
+
+    """
+    Thread-safe token bucket. Tokens are refilled at ``rate`` per second up to
+    a maximum of ``burst`` tokens, each request takes one. If the bucket is
+    empty, the request will reserve a future token and wait for it, so that
+    concurrent callers are served in turn at exactly the allowed rate.
+
+    One bucket can be shared by several ``API`` instances (and threads)::
+
+        limiter = TokenBucket(rate=1, burst=1)
+        api_de = API(AWS_KEY, SECRET_KEY, 'de', limiter=limiter)
+        api_uk = API(AWS_KEY, SECRET_KEY, 'uk', limiter=limiter)
+
+    """
+
+    def __init__(self, rate=1, burst=1, clock=monotonic, sleep=time.sleep):
+        """
+        :param rate: tokens (i.e. requests) per second.
+        :param burst: maximum number of requests which can be sent at once
+          after the bucket has been idle for a while.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes ``tokens`` from the bucket and returns the number of seconds the
+        caller has to wait before they are actually available.
+        """
+        self._lock.acquire()
+        try:
+            return self._take(tokens)
+        finally:
+            self._lock.release()
+
+    def _refill(self):
+        """
+        Adds tokens for the time since the last update (the caller must hold
+        the lock).
+        """
+        now = self.clock()
+        # a clock which stepped back (e.g. the wall clock used to share state
+        # between processes) must not take tokens away; an update "in the
+        # future" is simply treated as now
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def _take(self, tokens):
+        """
+        Refills bucket and takes ``tokens`` (the caller must hold the lock).
+        """
+        self._refill()
+        self.tokens -= tokens
+        if self.tokens < 0:
+            return -self.tokens / self.rate
+        return 0
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until ``tokens`` requests may be sent.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+
+    def set_rate(self, rate):
+        """
+        Changes ``rate``. Tokens for the time since the last update are still
+        added at the old rate.
+        """
+        self._lock.acquire()
+        try:
+            self._refill()
+            self.rate = float(rate)
+        finally:
+            self._lock.release()
+
+
+class AdaptiveRateLimiter (TokenBucket):
+
+    """
+    Token bucket which adapts its rate to what Amazon actually allows (which
+    depends on the revenue generated by your associate account). The rate is
+    increased additively with every successful request and cut
+    multiplicatively whenever a request gets throttled (AIMD). ``API`` will
+    transparently retry throttled requests after a random delay::
+
+        limiter = AdaptiveRateLimiter(rate=1, max_rate=5)
+        api = API(AWS_KEY, SECRET_KEY, 'de', limiter=limiter)
+
+    """
+
+    def __init__(self, rate=1, burst=1, min_rate=.1, max_rate=10,
+                 increase=.05, decrease=.5, clock=monotonic,
+                 sleep=time.sleep):
+        """
+        :param min_rate: rate will never drop below this.
+        :param max_rate: rate will never exceed this.
+        :param increase: requests per second added after each success.
+        :param decrease: factor the rate is multiplied with when throttled.
+        """
+        TokenBucket.__init__(self, rate, burst, clock, sleep)
+        self.min_rate, self.max_rate = float(min_rate), float(max_rate)
+        self.increase, self.decrease = increase, decrease
+
+    def set_rate(self, rate):
+        """
+        Changes ``rate`` (within ``min_rate`` and ``max_rate``).
+        """
+        TokenBucket.set_rate(self, min(self.max_rate, max(self.min_rate, rate)))
+
+    def success(self):
+        """
+        Request was successful: increase rate.
+        """
+        self.set_rate(self.rate + self.increase)
+
+    def throttled(self):
+        """
+        Request was throttled: decrease rate and wait for a random time (to
+        avoid several clients retrying in lockstep).
+        """
+        self.set_rate(self.rate * self.decrease)
+        self.sleep(random.uniform(.5, 1.5) / self.rate)
+
+
+class FileRateLimiter (TokenBucket):
+
+    """
+    Token bucket whose state is kept in a small file which is locked for
+    every request. This way several processes on the same host (e.g.
+    pre-forked workers) can share one request budget::
+
+        limiter = FileRateLimiter('/var/run/myapp/amazon-%s.bucket' % AWS_KEY)
+        api = API(AWS_KEY, SECRET_KEY, 'de', limiter=limiter)
+
+    The file is opened anew in each process, so the limiter can safely be
+    created before forking.
+
+    .. note:: This requires ``fcntl`` and is not available on Windows.
+    """
+
+    _format = '!dd' # tokens, timestamp of last update
+
+    def __init__(self, path, rate=1, burst=1, sleep=time.sleep):
+        """
+        :param path: file to store bucket state in. It is created if it does
+          not exist yet.
+        """
+        if fcntl is None: # pragma: no cover
+            raise RuntimeError(
+                'FileRateLimiter needs fcntl which is not available!')
+        # the clock has to be the same for all processes
+        TokenBucket.__init__(self, rate, burst, clock=time.time, sleep=sleep)
+        self.path = path
+        self._fp, self._pid = None, None
+
+    def _file(self):
+        """
+        Returns state file opened by this very process. File locks are shared
+        with forked children if the file was opened before forking.
+        """
+        if self._pid != os.getpid():
+            self._fp = open(self.path, 'a+b')
+            self._pid = os.getpid()
+        return self._fp
+
+    def reserve(self, tokens=1):
+        self._lock.acquire()
+        try:
+            fp = self._file()
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            try:
+                fp.seek(0)
+                data = fp.read(struct.calcsize(self._format))
+                if data:
+                    self.tokens, self.updated = struct.unpack(
+                        self._format, data)
+                else:
+                    self.tokens, self.updated = self.burst, self.clock()
+                wait = self._take(tokens)
+                fp.seek(0)
+                fp.truncate()
+                fp.write(struct.pack(self._format, self.tokens, self.updated))
+                fp.flush()
+                return wait
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_limiter(access_key, rate=1, burst=1, locale=None):
+    """
+    Returns the ``TokenBucket`` used for all requests with ``access_key``
+    (to the endpoint of ``locale``) within this process. ``API`` instances
+    use the one for their locale by default, so that creating a new instance
+    does not reset the request budget. There is only one bucket per access
+    key and locale (as the request limit applies to the account), ``rate``
+    and ``burst`` are only used when it is created.
+    """
+    _shared_lock.acquire()
+    try:
+        key = (access_key, locale)
+        if key not in _shared:
+            _shared[key] = TokenBucket(rate, burst)
+        return _shared[key]
+    finally:
+        _shared_lock.release()
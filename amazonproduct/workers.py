@@ -0,0 +1,165 @@
+# Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
+#
+# This program is release under the BSD License. You can find the full text of
+# the license in the LICENSE file.
+
+"""
+Minimal thread pool with futures to run API calls concurrently.
+"""
+
+import sys
+import threading
+from Queue import Queue
+
+class Future (object):
+
+    """
+    Result of a call which is executed in the background. Calling
+    :meth:`result` blocks until the call has finished and either returns its
+    return value or re-raises the exception it raised.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        """
+        Returns ``True`` if the call has finished.
+        """
+        return self._done.isSet()
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        if not self.done():
+            raise RuntimeError('Call did not finish within %s seconds!' %
+                               timeout)
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish and returns its result. Any exception
+        raised by the call will be re-raised here.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the call to finish and returns the exception it raised (or
+        ``None`` if it was successful).
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def add_done_callback(self, fnc):
+        """
+        Calls ``fnc(future)`` as soon as the call has finished (or right away
+        if it already is).
+        """
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(fnc)
+                return
+        finally:
+            self._lock.release()
+        fnc(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """
+        :param exc_info: tuple as returned by ``sys.exc_info()``.
+        """
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for fnc in callbacks:
+            fnc(self)
+
+
+class WorkerPool (object):
+
+    """
+    Fixed number of worker threads executing submitted calls in order. This
+    limits the number of requests in flight no matter how many calls are
+    queued::
+
+        pool = WorkerPool(4)
+        futures = [pool.submit(api.item_lookup, asin) for asin in asins]
+        roots = [future.result() for future in futures]
+
+    Worker threads are started on first use and are daemonic, i.e. they will
+    not prevent the interpreter from exiting.
+    """
+
+    def __init__(self, workers=4):
+        self.size = workers
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            future, fnc, args, kwargs = job
+            try:
+                result = fnc(*args, **kwargs)
+            except:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+    def submit(self, fnc, *args, **kwargs):
+        """
+        Schedules ``fnc(*args, **kwargs)`` for execution and returns a
+        ``Future`` for its result.
+        """
+        if len(self._threads) < self.size:
+            self._start()
+        future = Future()
+        self._queue.put((future, fnc, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stops all workers once the queued calls are processed.
+        """
+        self._lock.acquire()
+        try:
+            threads, self._threads = self._threads, []
+        finally:
+            self._lock.release()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
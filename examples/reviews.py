@@ -9,7 +9,6 @@ from textwrap import fill
 
 from config import AWS_KEY, SECRET_KEY
 from amazonproduct import API
-from amazonproduct import ResultPaginator
 
 if __name__ == '__main__':
     
@@ -23,24 +22,13 @@ if __name__ == '__main__':
         isbn = isbn.replace('-', '')
         
         api = API(AWS_KEY, SECRET_KEY, 'us')
-        paginator = ResultPaginator('ReviewPage',
-            '//aws:Items/aws:Request/aws:ItemLookupRequest/aws:ReviewPage',
-            '//aws:Items/aws:Item/aws:CustomerReviews/aws:TotalReviewPages',
-            '//aws:Items/aws:Item/aws:CustomerReviews/aws:TotalReviews')
+        paginator = api.item_reviews(isbn, IdType='ISBN', SearchIndex='Books')
         
-        for root in paginator(api.item_lookup, isbn, IdType='ISBN', 
-                             SearchIndex='Books', ResponseGroup='Reviews'):
+        for root in paginator:
         
-            rating = root.Items.Item.CustomerReviews.AverageRating.pyval
-            total_reviews = root.Items.Item.CustomerReviews.TotalReviews.pyval
-            review_pages = root.Items.Item.CustomerReviews.TotalReviewPages.pyval
-            try:
-                current_page = root.Items.Request.ItemLookupRequest.ReviewPage.pyval
-            except AttributeError:
-                current_page = 1
-                
-            print '%d reviews' % total_reviews,
-            print 'requested page %d of %d' % (current_page, review_pages)
+            print '%d reviews' % paginator.results,
+            print 'requested page %d of %d' % (paginator.current,
+                                               paginator.pages)
             
             nspace = root.nsmap.get(None, '')
             reviews = root.xpath('//aws:CustomerReviews/aws:Review', 
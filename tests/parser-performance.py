@@ -1,36 +1,63 @@
 # Copyright (C) 2010 Sebastian Rahlf <basti at redtoad dot de>
 
 """
-Compare performance of different parsing methods. On my netbook the following
-output was generated::
+Compares the performance of all response processors using the XML responses
+stored for the tests. All files are loaded into memory once, each processor is
+then run in a process of its own. For each one the following is reported:
 
-    Collecting test files...
-    Parsing 2020 XML files...
-    minidom 25.83
-    lxml.etree 1.79
-    lxml.objectify 2.43
+* throughput in documents and megabytes per second,
+* the peak memory used by the process on top of the loaded responses (only on
+  systems providing module ``resource``),
+* for each group of fixtures (all responses of one operation, e.g.
+  ``ItemSearch``) the median (p50) and 99th percentile (p99) of the time
+  needed to parse a single response. Small cart responses would otherwise
+  hide how long large search results take.
 
-"""
+Example::
 
-import os.path
-import time
+    $ python tests/parser-performance.py --runs 5
+    Parsing 3785 XML responses (10.2 MB) 5 times...
+    processor            docs/s     MB/s   peak (kB)
+    lxml.etree          13754.0     36.9        9648
+      fixtures                  docs   p50 (ms)   p99 (ms)
+      BrowseNodeLookup           630      0.093      0.412
+      ...
 
-import lxml.etree
-import lxml.objectify
-import xml.dom.minidom
+Use ``--json`` for machine-readable output which can be stored and compared
+with later runs (``--compare results.json``). The exit code will be 1 if any
+processor's throughput has dropped or any fixture group's p50 or p99 has
+risen by more than ``--tolerance``.
+"""
 
-# make sure that amazonproduct can be imported
-# from parent directory
+from optparse import OptionParser
+import os
+import subprocess
 import sys
-sys.path.insert(0, '..')
+from StringIO import StringIO
+from timeit import default_timer as timer
+
+try:
+    import json
+except ImportError: # pragma: no cover
+    import simplejson as json
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    resource = None
+
+# make sure that amazonproduct and the test package can be imported
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _root)
 
-from amazonproduct import API
 from amazonproduct import AWSError
-from config import AWS_KEY, SECRET_KEY
+from amazonproduct import processors
+from tests import XML_TEST_DIR, TESTABLE_API_VERSIONS
 
-# xml.minidom
+# xml.minidom (as in the documentation)
 #
 def minidom_response_parser(fp):
+    import xml.dom.minidom
     root = xml.dom.minidom.parse(fp)
     # parse errors
     for error in root.getElementsByTagName('Error'):
@@ -39,54 +66,255 @@ def minidom_response_parser(fp):
         raise AWSError(code, msg)
     return root
 
-# lxml.objectify
-#
-def objectify_response_parser(fp):
-    root = lxml.objectify.parse(fp).getroot()
-    nspace = root.nsmap.get(None, '')
-    errors = root.xpath('//aws:Request/aws:Errors/aws:Error', 
-                        namespaces={'aws' : nspace})
-    for error in errors:
-        raise AWSError(error.Code.text, error.Message.text)
-    return root
+def iterparse_response_parser():
+    processor = processors.LxmlIterparseProcessor()
+    # consume all items (which is what the processor is used for)
+    def parse(fp):
+        for item in processor(fp):
+            pass
+    return parse
 
-# lxml.etree
-#
-def etree_response_parser(fp):
-    root = lxml.etree.parse(fp).getroot()
-    error = root.find('Error')
-    if error is not None:
-        raise AWSError(error.Code.text, error.Message.text)
-    return root
+#: Processors which are benchmarked (label, factory)
+PROCESSORS = [
+    ('lxml.objectify', processors.LxmlObjectifyProcessor),
+    ('lxml.etree', processors.LxmlEtreeProcessor),
+    ('lxml.iterparse', iterparse_response_parser),
+    ('expat', processors.ExpatProcessor),
+    ('minidom', lambda: minidom_response_parser),
+]
+
+
+def load_responses(versions=TESTABLE_API_VERSIONS):
+    """
+    Returns list of tuples ``(name, data)`` for all stored XML responses of
+    the specified API versions.
+    """
+    responses = []
+    for version in versions:
+        folder = os.path.join(XML_TEST_DIR, version)
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith('.xml'):
+                fp = open(os.path.join(folder, name), 'rb')
+                try:
+                    responses.append(('%s/%s' % (version, name), fp.read()))
+                finally:
+                    fp.close()
+    return responses
+
+
+def peak_memory():
+    """
+    Returns the peak memory usage of this process in kB (or ``None``).
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage // 1024 # bytes on Mac OS X
+    return usage
+
+
+def fixture_group(name):
+    """
+    Returns the group of fixture ``name`` (the operation it was recorded
+    for, e.g. ``ItemSearch`` for ``2010-12-01/ItemSearch-de-books.xml``).
+    """
+    return os.path.basename(name).split('-')[0]
 
-if __name__ == '__main__':
 
-    #: how many times are all XML files parsed
-    RUNS = 10
+def percentile(values, p):
+    """
+    Returns the ``p``-th percentile of sorted list ``values``.
+    """
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
 
-    custom_parsers = {
-        'lxml.objectify' : objectify_response_parser, 
-        'lxml.etree' : etree_response_parser, 
-        'minidom' : minidom_response_parser, 
+
+def benchmark(label, factory, responses, runs):
+    """
+    Parses all ``responses`` ``runs`` times with the processor created by
+    ``factory`` and returns a dictionary with the results.
+    """
+    processor = factory()
+    parse = getattr(processor, 'fromstring', None)
+    if parse is None:
+        parse = lambda data: processor(StringIO(data))
+
+    groups = [(fixture_group(name), name, data) for name, data in responses]
+    baseline = peak_memory()
+    timings = {}
+    failures = {}
+    started = timer()
+    for run in range(runs):
+        for group, name, data in groups:
+            start = timer()
+            try:
+                parse(data)
+            except AWSError:
+                pass
+            except Exception, e:
+                failures[name] = '%s: %s' % (e.__class__.__name__, e)
+            timings.setdefault(group, []).append(timer() - start)
+    total = timer() - started
+
+    fixtures = {}
+    for group, values in timings.items():
+        values.sort()
+        fixtures[group] = {
+            'documents' : len(values),
+            'p50_ms' : percentile(values, 50) * 1000,
+            'p99_ms' : percentile(values, 99) * 1000,
+        }
+    size = sum([len(data) for name, data in responses]) * runs
+    result = {
+        'processor' : label,
+        'runs' : runs,
+        'documents' : len(responses) * runs,
+        'seconds' : total,
+        'docs_per_second' : len(responses) * runs / total,
+        'mb_per_second' : size / total / 1024.0 / 1024.0,
+        'fixtures' : fixtures,
+        'failures' : sorted(failures.items()),
+        'peak_memory_kb' : None,
     }
+    if baseline is not None:
+        result['peak_memory_kb'] = peak_memory() - baseline
+    return result
+
+
+def run_isolated(label, options):
+    """
+    Runs benchmark for processor ``label`` in a process of its own (so that
+    peak memory usage can be measured separately) and returns its result.
+    """
+    args = [sys.executable, os.path.abspath(__file__), '--json',
+            '--runs', str(options.runs), '--processor', label]
+    for version in options.versions:
+        args.extend(['--version', version])
+    child = subprocess.Popen(args, stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode != 0:
+        return None
+    # the result is missing if the processor is not available
+    results = json.loads(output)
+    if not results:
+        return None
+    return results[0]
+
+
+def compare(results, path, tolerance):
+    """
+    Compares throughput and the parsing times of each fixture group with
+    results stored in file ``path`` and returns list of messages for all
+    values which got worse by more than ``tolerance``.
+    """
+    fp = open(path)
+    try:
+        previous = dict([(result['processor'], result)
+                         for result in json.load(fp)])
+    finally:
+        fp.close()
+    regressions = []
+    for result in results:
+        old = previous.get(result['processor'])
+        if old is None:
+            continue
+        ratio = result['docs_per_second'] / old['docs_per_second']
+        if ratio < 1 - tolerance:
+            regressions.append('%s: %.1f docs/s (was %.1f, -%.0f%%)' % (
+                result['processor'], result['docs_per_second'],
+                old['docs_per_second'], (1 - ratio) * 100))
+        # results stored by earlier versions have no fixture groups
+        old_fixtures = old.get('fixtures', {})
+        for group in sorted(result['fixtures']):
+            if group not in old_fixtures:
+                continue
+            for key in ('p50_ms', 'p99_ms'):
+                value = result['fixtures'][group][key]
+                before = old_fixtures[group][key]
+                if before and value > before * (1 + tolerance):
+                    regressions.append('%s %s %s: %.3f ms (was %.3f, '
+                        '+%.0f%%)' % (result['processor'], group, key[:3],
+                        value, before, (value / before - 1) * 100))
+    return regressions
 
-    print "Collecting test files..."
-    xml_files = [os.path.join(root, file)
-        for root, dirs, files in os.walk('.')
-        for file in files
-        if os.path.splitext(file)[1].lower() == '.xml']
-
-    print "Parsing %i XML files..." % (len(xml_files)*RUNS, )
-    for label, parser in custom_parsers.items():
-        print label, 
-        start = time.clock()
-        api = API(AWS_KEY, SECRET_KEY, 'de', processor=parser)
-        for i in range(RUNS):
-            for path in xml_files:
-                try:
-                    api._parse(open(path))
-                except Exception, e:
-                    pass
 
-        stop = time.clock()
-        print stop - start
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]', description=(
+        'Benchmarks all response processors using the stored XML responses.'))
+    parser.add_option('-r', '--runs', type='int', default=3,
+        help='how many times all responses are parsed (default: %default)')
+    parser.add_option('-p', '--processor', action='append', dest='processors',
+        metavar='NAME', help='only benchmark this processor (one of %s)' %
+        ', '.join([label for label, factory in PROCESSORS]))
+    parser.add_option('-v', '--version', action='append', dest='versions',
+        metavar='VERSION', help='only use responses for this API version')
+    parser.add_option('--json', action='store_true',
+        help='print results as JSON')
+    parser.add_option('--compare', metavar='FILE',
+        help='compare with results previously stored with --json')
+    parser.add_option('--tolerance', type='float', default=.1,
+        help='allowed loss of throughput (or increase of parsing times) when '
+        'comparing (default: %default)')
+    options, args = parser.parse_args(argv)
+
+    options.versions = options.versions or TESTABLE_API_VERSIONS
+    factories = dict(PROCESSORS)
+    labels = options.processors or [label for label, factory in PROCESSORS]
+    for label in labels:
+        if label not in factories:
+            parser.error('unknown processor %r' % label)
+
+    responses = load_responses(options.versions)
+    if not options.json:
+        print 'Parsing %i XML responses (%.1f MB) %i times...' % (
+            len(responses), sum([len(data) for name, data in responses])
+            / 1024.0 / 1024.0, options.runs)
+
+    results = []
+    for label in labels:
+        if len(labels) == 1:
+            try:
+                result = benchmark(label, factories[label], responses,
+                                   options.runs)
+            except ImportError:
+                # required module (e.g. lxml) is not installed
+                result = None
+        else:
+            result = run_isolated(label, options)
+        if result is not None:
+            results.append(result)
+        elif not options.json:
+            print >> sys.stderr, '%s is not available!' % label
+
+    if options.json:
+        print json.dumps(results, indent=2)
+    else:
+        print '%-16s %10s %8s %11s' % (
+            'processor', 'docs/s', 'MB/s', 'peak (kB)')
+        for result in results:
+            print '%-16s %10.1f %8.1f %11s' % (
+                result['processor'], result['docs_per_second'],
+                result['mb_per_second'],
+                result['peak_memory_kb'] is None and 'n/a'
+                or result['peak_memory_kb'])
+            print '  %-22s %6s %10s %10s' % (
+                'fixtures', 'docs', 'p50 (ms)', 'p99 (ms)')
+            for group in sorted(result['fixtures']):
+                fixture = result['fixtures'][group]
+                print '  %-22s %6i %10.3f %10.3f' % (group,
+                    fixture['documents'], fixture['p50_ms'], fixture['p99_ms'])
+            for name, error in result['failures']:
+                print '  failed: %s (%s)' % (name, error)
+
+    if options.compare:
+        regressions = compare(results, options.compare, options.tolerance)
+        for message in regressions:
+            print >> sys.stderr, 'Regression: %s' % message
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,11 +27,15 @@ class TestServer (HTTPServer):
     #: timeout for request handling (in seconds?)
     timeout = 1
     
-    def __init__(self, host=DEFAULT_ADDRESS, port=DEFAULT_PORT):
-        HTTPServer.__init__(self, (host, port), RequestHandler)
+    def __init__(self, host=DEFAULT_ADDRESS, port=DEFAULT_PORT, 
+                 handler=None):
+        HTTPServer.__init__(self, (host, port), handler or RequestHandler)
         self.file, self.code = (None, 204) # HTTP 204: No Content
+        self.headers = {}
         self._thread = None
         self.logging = False
+        self.connections = 0 # number of accepted connections
+        self.requests = [] # paths of all received requests
 
         # Workaround for Python 2.4: using port 0 will bind a free port to the 
         # underlying socket. The server_address, however, is not reflecting 
@@ -39,12 +43,13 @@ class TestServer (HTTPServer):
         if self.server_address[1] == 0: 
             self.server_address = (self.server_address[0], self.server_port)
 
-    def serve_file(self, path=None, code=200):
+    def serve_file(self, path=None, code=200, headers=None):
         """
-        Serves file (with specified HTTP error code) as response to next 
-        request.
+        Serves file (with specified HTTP error code and additional headers) as
+        response to next request.
         """
         self.file, self.code = (path, code)
+        self.headers = headers or {}
         
     def serve_forever (self):
         """
@@ -79,6 +84,10 @@ class RequestHandler(BaseHTTPRequestHandler):
     Handler for HTTP requests serving files specified by server instance.
     """
     
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
     def log_message(self, format, *args):
         """
         Overrides standard logging method.
@@ -92,16 +101,29 @@ class RequestHandler(BaseHTTPRequestHandler):
         Any GET response will be sent ``self.server.file`` as message and 
         ``self.server.code`` as response code.
         """
-        self.send_response(self.server.code)
-        self.end_headers()
-        
+        self.server.requests.append(self.path)
         if type(self.server.file) in (str, unicode):
-            self.wfile.write(open(self.server.file).read())
+            body = open(self.server.file).read()
         else:
-            self.wfile.write(self.server.file)
+            body = str(self.server.file or '')
             
+        self.send_response(self.server.code)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in self.server.headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
         return
 
+class KeepAliveRequestHandler (RequestHandler):
+    
+    """
+    Handler which keeps connections alive (HTTP/1.1).
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    timeout = 1 # close idle connections after one second
+
 
 if __name__ == '__main__':
     server = TestServer()
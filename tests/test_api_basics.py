@@ -1,7 +1,17 @@
 
+from base64 import b64encode
 from datetime import datetime, timedelta
+import gzip
+import hashlib
+import hmac
 import pytest
 import os.path
+from StringIO import StringIO
+import tempfile
+import threading
+import time
+import urllib2
+from urllib2 import quote
 
 try:
     from urlparse import urlparse, parse_qs
@@ -11,10 +21,18 @@ except ImportError:
 
 from tests import TESTABLE_API_VERSIONS, XML_TEST_DIR
 from tests.utils import convert_camel_case, extract_operations_from_wsdl
-from server import TestServer
+from server import TestServer, KeepAliveRequestHandler
 
-from amazonproduct import API
-from amazonproduct import UnknownLocale, TooManyRequests
+from amazonproduct import API, AsyncAPI, MultiLocaleAPI, LazyResponse
+from amazonproduct.connection import ConnectionPool, GzipStream
+from amazonproduct.contrib.caching import ResponseCachingAPI
+from amazonproduct.contrib.singleflight import SingleFlightAPI
+from amazonproduct.throttling import TokenBucket
+from amazonproduct import HOSTS
+from amazonproduct import UnknownLocale, TooManyRequests, AWSError
+from amazonproduct import InvalidParameterValue, NoSimilarityForASIN
+from amazonproduct import InvalidResponseGroup
+from amazonproduct import processors
 
 class TestAPILocales (object):
 
@@ -53,6 +71,19 @@ class TestAPICalls (object):
         pytest.raises(TooManyRequests, self.api.item_lookup, '9780747532743', 
             IdType='ISBN', SearchIndex='All', ResponseGroup='???')
 
+    def test_gzipped_response(self, tmpdir):
+        xml = os.path.join(XML_TEST_DIR, API.VERSION,
+            'ItemLookup-uk-valid-asin.xml')
+        path = str(tmpdir.join('response.xml.gz'))
+        fp = gzip.open(path, 'wb')
+        fp.write(open(xml).read())
+        fp.close()
+        self.server.serve_file(path, 200, {'Content-Encoding' : 'gzip'})
+        url = self.api._build_url(Operation='ItemLookup', ItemId='0747532745')
+        resp = self.api._fetch(url)
+        assert isinstance(resp, GzipStream)
+        assert resp.read() == open(xml).read()
+
     @pytest.mark.slowtest
     def test_call_throtteling(self):
         url = self.api._build_url(Operation='ItemSearch', SearchIndex='Books')
@@ -64,6 +95,681 @@ class TestAPICalls (object):
         stop = datetime.now()
         assert (stop-start) >= (n-1)*self.api.throttle
 
+class TestConnectionPool (object):
+
+    """
+    Test that connections are kept alive and reused.
+    """
+
+    def setup_method(self, method):
+        self.server = TestServer(handler=KeepAliveRequestHandler)
+        self.server.start()
+        self.url = 'http://%s:%i/onca/xml?Operation=Help' % (
+            self.server.server_address)
+
+    def teardown_method(self, method):
+        self.server.stop()
+        os.remove(self.path)
+
+    def serve(self, body, code=200):
+        fd, self.path = tempfile.mkstemp(suffix='.xml')
+        os.write(fd, body)
+        os.close(fd)
+        self.server.serve_file(self.path, code)
+
+    def test_connection_is_reused(self):
+        pool = ConnectionPool()
+        self.serve('<xml/>')
+        for i in range(3):
+            assert pool.urlopen(self.url).read() == '<xml/>'
+        assert self.server.connections == 1
+
+    def test_idle_connections_are_evicted(self):
+        pool = ConnectionPool(idle_timeout=-1)
+        self.serve('<xml/>')
+        for i in range(3):
+            assert pool.urlopen(self.url).read() == '<xml/>'
+        assert self.server.connections == 3
+
+    def test_partially_read_connection_is_not_reused(self):
+        pool = ConnectionPool()
+        self.serve('<xml/>')
+        fp = pool.urlopen(self.url)
+        assert fp.read(2) == '<x'
+        fp.close()
+        assert pool.urlopen(self.url).read() == '<xml/>'
+        assert self.server.connections == 2
+
+    def test_http_errors_are_raised(self):
+        pool = ConnectionPool()
+        self.serve('<error/>', 400)
+        e = pytest.raises(urllib2.HTTPError, pool.urlopen, self.url).value
+        assert e.code == 400
+        assert e.read() == '<error/>'
+
+    def test_proxy_is_used(self, monkeypatch):
+        proxy = 'http://%s:%i' % self.server.server_address
+        monkeypatch.setenv('http_proxy', proxy)
+        monkeypatch.setenv('no_proxy', '')
+        pool = ConnectionPool()
+        self.serve('<xml/>')
+        url = 'http://webservices.example.com/onca/xml?Operation=Help'
+        assert pool.urlopen(url).read() == '<xml/>'
+        assert self.server.requests == [url]
+
+    def test_proxy_is_bypassed(self, monkeypatch):
+        monkeypatch.setenv('http_proxy', 'http://proxy.invalid:3128')
+        monkeypatch.setenv('no_proxy', self.server.server_address[0])
+        pool = ConnectionPool()
+        self.serve('<xml/>')
+        assert pool.urlopen(self.url).read() == '<xml/>'
+        assert self.server.requests == ['/onca/xml?Operation=Help']
+
+    def test_api_shares_pool(self):
+        pool = ConnectionPool()
+        api = API('', '', 'uk', pool=pool, limiter=TokenBucket(burst=2))
+        api.host = ('%s:%i' % self.server.server_address, )
+        self.serve('<xml/>')
+        url = api._build_url(Operation='ItemSearch', SearchIndex='Books')
+        for i in range(2):
+            api._fetch(url).read()
+        assert self.server.connections == 1
+
+
+class TestGzipStream (object):
+
+    """
+    Test on-the-fly decompression of gzip-encoded responses.
+    """
+
+    def test_decompresses_incrementally(self, tmpdir):
+        data = ''.join(['<Item>%i</Item>' % i for i in range(10000)])
+        path = str(tmpdir.join('data.gz'))
+        fp = gzip.open(path, 'wb')
+        fp.write(data)
+        fp.close()
+        raw = open(path, 'rb')
+        stream = GzipStream(raw)
+        assert stream.read(10) == data[:10]
+        # only the first chunk of the compressed data has been read yet
+        assert raw.tell() == GzipStream.chunk_size
+        assert stream.read(100) == data[10:110]
+        assert stream.read() == data[110:]
+        assert stream.read() == ''
+
+    def test_read_everything_at_once(self, tmpdir):
+        data = ''.join(['<Item>%i</Item>' % i for i in range(10000)])
+        path = str(tmpdir.join('data.gz'))
+        fp = gzip.open(path, 'wb')
+        fp.write(data)
+        fp.close()
+        assert GzipStream(open(path, 'rb')).read() == data
+
+
+class TestAsyncAPI (object):
+
+    """
+    Test non-blocking API calls with ``TestServer`` instance.
+    """
+
+    def setup_class(cls):
+        cls.api = AsyncAPI('', '', 'de', workers=2,
+                           limiter=TokenBucket(rate=5))
+        cls.server = TestServer()
+        cls.api.host = ('%s:%i' % cls.server.server_address, )
+        cls.server.start()
+
+    def teardown_class(cls):
+        cls.server.stop()
+
+    def test_operations_return_futures(self):
+        xml = os.path.join(XML_TEST_DIR, API.VERSION,
+            'ItemLookup-de-valid-asin.xml')
+        self.server.serve_file(xml)
+        futures = [self.api.item_lookup('0747532745') for i in range(3)]
+        for future in futures:
+            assert future.result().Items.Item.ASIN == '0747532745'
+
+    def test_errors_are_raised_by_result(self):
+        xml = os.path.join(XML_TEST_DIR,
+            'APICalls-fails-for-too-many-requests.xml')
+        self.server.serve_file(xml, 503)
+        future = self.api.item_lookup('0747532745')
+        pytest.raises(TooManyRequests, future.result)
+        assert isinstance(future.exception(), TooManyRequests)
+
+    @pytest.mark.slowtest
+    def test_concurrent_calls_are_throttled(self):
+        self.server.serve_file(None, 200)
+        url = self.api._build_url(Operation='ItemSearch', SearchIndex='Books')
+        start = datetime.now()
+        n = 4
+        futures = [self.api.workers.submit(self.api._fetch, url)
+                   for i in range(n)]
+        for future in futures:
+            future.result()
+        stop = datetime.now()
+        assert (stop-start) >= (n-1)*self.api.throttle
+
+
+class ItemLookupAPI (API):
+
+    """
+    Answers ``ItemLookup`` requests with generated XML responses. Each id
+    starting with ``X`` is treated as invalid.
+    """
+
+    RESPONSE = '''<ItemLookupResponse
+      xmlns="http://webservices.amazon.com/AWSECommerceService/2010-12-01">
+      <Items><Request><IsValid>True</IsValid>%s</Request>%s</Items>
+    </ItemLookupResponse>'''
+    ERROR = ('<Errors><Error><Code>AWS.InvalidParameterValue</Code>'
+      '<Message>%s is not a valid value for ItemId. Please change this value '
+      'and retry your request.</Message></Error></Errors>')
+    ITEM = '<Item><ASIN>%s</ASIN></Item>'
+
+    def __init__(self, *args, **kwargs):
+        API.__init__(self, *args, **kwargs)
+        self.requests = []
+
+    def _fetch(self, url):
+        ids = parse_qs(urlparse(url)[4])['ItemId'][0].split(',')
+        self.requests.append(ids)
+        errors = ''.join([self.ERROR % id for id in ids if id[0] == 'X'])
+        items = ''.join([self.ITEM % id for id in ids if id[0] != 'X'])
+        return StringIO(self.RESPONSE % (errors, items))
+
+
+class TestItemLookupMany (object):
+
+    """
+    Test that item lookups are coalesced into as few requests as possible.
+    """
+
+    def setup_method(self, method):
+        self.api = ItemLookupAPI('', '', 'de', limiter=TokenBucket(1000, 100))
+
+    def test_ids_are_chunked(self):
+        ids = ['%010i' % i for i in range(25)]
+        items, invalid = self.api.item_lookup_many(ids)
+        assert [len(chunk) for chunk in self.api.requests] == [10, 10, 5]
+        assert sorted(items.keys()) == ids
+        assert items['0000000003'].ASIN == '0000000003'
+        assert invalid == []
+
+    def test_duplicates_are_removed(self):
+        ids = ['0000000001', '0000000002'] * 10
+        items, invalid = self.api.item_lookup_many(ids)
+        assert self.api.requests == [['0000000001', '0000000002']]
+        assert len(items) == 2
+
+    def test_invalid_ids_are_reported(self):
+        ids = ['0000000001', 'X000000002', '0000000003', 'X000000004']
+        items, invalid = self.api.item_lookup_many(ids)
+        assert sorted(items.keys()) == ['0000000001', '0000000003']
+        assert invalid == ['X000000002', 'X000000004']
+        # invalid ids are reported without repeating the request
+        assert self.api.requests == [ids]
+
+    @pytest.mark.parametrize('processor', [
+        processors.LxmlObjectifyProcessor,
+        processors.LxmlEtreeProcessor,
+        processors.ExpatProcessor,
+    ])
+    def test_invalid_ids_are_reported_by_all_processors(self, processor):
+        api = ItemLookupAPI('', '', 'de', limiter=TokenBucket(1000, 100),
+                            processor=processor())
+        ids = ['X000000001', '0000000002', 'X000000003']
+        items, invalid = api.item_lookup_many(ids)
+        assert items.keys() == ['0000000002']
+        assert invalid == ['X000000001', 'X000000003']
+        assert len(api.requests) == 1
+
+    def test_requests_are_repeated_without_split_items(self):
+        # processors which cannot return items along with errors
+        api = ItemLookupAPI('', '', 'de', limiter=TokenBucket(1000, 100),
+                            processor=processors.LxmlIterparseProcessor())
+        ids = ['X000000001', '0000000002', 'X000000003']
+        items, invalid = api.item_lookup_many(ids)
+        assert items.keys() == ['0000000002']
+        assert invalid == ['X000000001', 'X000000003']
+        assert len(api.requests) == 3
+        assert ids == ['X000000001', '0000000002', 'X000000003']
+
+    def test_failure_stops_remaining_chunks(self):
+        class FailingAPI (ItemLookupAPI):
+            def _fetch(self, url):
+                fp = ItemLookupAPI._fetch(self, url)
+                if len(self.requests) == 2:
+                    raise urllib2.HTTPError(url, 500, 'Error', {}, None)
+                return fp
+        api = FailingAPI('', '', 'de', limiter=TokenBucket(1000, 100))
+        ids = ['%010i' % i for i in range(100)]
+        pytest.raises(urllib2.HTTPError, api.item_lookup_many, ids,
+                      workers=2)
+        time.sleep(.2) # give workers the chance to fetch queued chunks
+        # at most the chunk in flight on the other worker is still fetched
+        assert len(api.requests) <= 3
+
+    def test_other_errors_are_raised(self):
+        api = ItemLookupAPI('', '', 'de', limiter=TokenBucket(1000, 100))
+        api.ERROR = ('<Errors><Error><Code>AWS.InvalidResponseGroup</Code>'
+            '<Message>The value you specified for ResponseGroup is invalid. '
+            '%s</Message></Error></Errors>')
+        pytest.raises(InvalidResponseGroup, api.item_lookup_many,
+                      ['X000000001'], ResponseGroup='Huge')
+
+    def test_only_invalid_ids(self):
+        items, invalid = self.api.item_lookup_many(['X000000001'])
+        assert items == {}
+        assert invalid == ['X000000001']
+
+    def test_chunks_are_fetched_concurrently(self):
+        ids = ['%010i' % i for i in range(100)] + ['X000000000']
+        items, invalid = self.api.item_lookup_many(ids, workers=4)
+        assert len(items) == 100
+        assert invalid == ['X000000000']
+        assert len(self.api.requests) == 11
+
+
+class BatchAPI (API):
+
+    """
+    Answers all requests with the same XML response and keeps the URL.
+    """
+
+    status = 200
+
+    def _fetch(self, url):
+        self.url = url
+        if self.status != 200:
+            raise urllib2.HTTPError(url, self.status, 'Bad Request', {},
+                                    StringIO(self.response))
+        return StringIO(self.response)
+
+
+class TestBatch (object):
+
+    """
+    Test batch and multi-operation requests.
+    """
+
+    NS = 'http://webservices.amazon.com/AWSECommerceService/2010-12-01'
+    ITEMS = ('<Items><Request><IsValid>True</IsValid>%s</Request>'
+             '<Item><ASIN>%s</ASIN></Item></Items>')
+    ERROR = '<Errors><Error><Code>%s</Code><Message>%s</Message></Error></Errors>'
+
+    def setup_method(self, method):
+        self.api = BatchAPI('', '', 'de')
+
+    def params(self):
+        return dict((key, val[0])
+                    for key, val in parse_qs(urlparse(self.api.url)[4]).items())
+
+    def test_batch_request(self):
+        self.api.response = (
+            '<ItemLookupResponse xmlns="%s"><OperationRequest/>%s%s'
+            '</ItemLookupResponse>' % (self.NS,
+                self.ITEMS % ('', '0201896834'),
+                self.ITEMS % ('', '0201896842')))
+        batch = self.api.batch()
+        vol1 = batch.item_lookup('0201896834')
+        vol2 = batch.item_lookup('0201896842', ResponseGroup='Large')
+        assert not vol1.done()
+        batch.execute()
+
+        params = self.params()
+        assert params['Operation'] == 'ItemLookup'
+        assert params['ItemLookup.1.ItemId'] == '0201896834'
+        assert params['ItemLookup.2.ItemId'] == '0201896842'
+        assert params['ItemLookup.2.ResponseGroup'] == 'Large'
+        assert 'ItemLookup.1.ResponseGroup' not in params
+
+        assert vol1.result().Items.Item.ASIN == '0201896834'
+        assert vol2.result().Items.Item.ASIN == '0201896842'
+
+    def test_multi_operation_request_with_errors(self):
+        error = self.ERROR % ('AWS.ECommerceService.NoSimilarities',
+            'There are no similar items for this ASIN: 0201896834.')
+        self.api.response = (
+            '<MultiOperationResponse xmlns="%s"><OperationRequest/>'
+            '<ItemLookupResponse>%s</ItemLookupResponse>'
+            '<SimilarityLookupResponse>%s</SimilarityLookupResponse>'
+            '</MultiOperationResponse>' % (self.NS,
+                self.ITEMS % ('', '0201896834'),
+                self.ITEMS % (error, '')))
+        batch = self.api.multi_operation()
+        item = batch.item_lookup('0201896834')
+        similar = batch.similarity_lookup('0201896834')
+        batch.execute()
+
+        params = self.params()
+        assert params['Operation'] == 'ItemLookup,SimilarityLookup'
+        assert params['SimilarityLookup.1.ItemId'] == '0201896834'
+
+        assert item.result().Items.Item.ASIN == '0201896834'
+        # errors are converted just like for single requests
+        e = pytest.raises(NoSimilarityForASIN, similar.result).value
+        assert e.args == ('0201896834', )
+
+    def test_batch_limits(self):
+        batch = self.api.batch()
+        batch.item_lookup('0201896834')
+        batch.item_lookup('0201896842')
+        pytest.raises(ValueError, batch.item_lookup, '0201896850')
+        batch.item_search('Books', Title='Python')
+        pytest.raises(ValueError, batch.browse_node_lookup, '1000')
+
+    def test_failing_batch_fails_all_requests(self):
+        self.api.response = (
+            '<ItemLookupErrorResponse xmlns="%s"><Error><Code>%s</Code>'
+            '<Message>%s</Message></Error></ItemLookupErrorResponse>' % (
+            self.NS, 'SignatureDoesNotMatch', 'Wrong signature.'))
+        batch = self.api.batch()
+        futures = [batch.item_lookup('0201896834'), batch.item_lookup('0')]
+        pytest.raises(AWSError, batch.execute)
+        for future in futures:
+            assert future.exception().code == 'SignatureDoesNotMatch'
+
+    def test_empty_batch_sends_nothing(self):
+        self.api.limiter = TokenBucket(rate=1, burst=1)
+        batch = self.api.batch()
+        batch.execute()
+        assert not hasattr(self.api, 'url')
+        # no token has been spent
+        assert self.api.limiter.reserve() == 0
+
+    def test_error_responses_are_parsed(self):
+        # HTTP errors 400 and 410 come with a detailed error message
+        self.api.status = 400
+        self.api.response = (
+            '<ItemLookupErrorResponse xmlns="%s"><Error><Code>%s</Code>'
+            '<Message>%s</Message></Error></ItemLookupErrorResponse>' % (
+            self.NS, 'MissingParameter', 'Parameter ItemId is missing.'))
+        e = pytest.raises(AWSError, self.api.call, Operation='ItemLookup')
+        assert e.value.code == 'MissingParameter'
+        batch = self.api.batch()
+        future = batch.item_lookup('0201896834')
+        pytest.raises(AWSError, batch.execute)
+        assert future.exception().code == 'MissingParameter'
+        self.api.status = 503
+        pytest.raises(urllib2.HTTPError, self.api.call, Operation='ItemLookup')
+
+
+class LocalePool (object):
+
+    """
+    Connection pool answering requests with the host name as ASIN. Requests
+    to hosts in ``failing`` are answered with HTTP 503.
+    """
+
+    RESPONSE = ItemLookupAPI.RESPONSE % ('', ItemLookupAPI.ITEM)
+
+    def __init__(self, *failing):
+        self.failing = failing
+
+    def urlopen(self, url, headers=None, debuglevel=0):
+        host = urlparse(url)[1]
+        if host in self.failing:
+            raise urllib2.HTTPError(url, 503, 'Service Unavailable', {},
+                                    StringIO(''))
+        fp = StringIO(self.RESPONSE % host)
+        fp.headers = {}
+        return fp
+
+
+class TestMultiLocaleAPI (object):
+
+    """
+    Test sending the same request to several locales.
+    """
+
+    def test_request_is_sent_to_all_locales(self):
+        api = MultiLocaleAPI('', '', pool=LocalePool())
+        results = api.item_lookup('0747532745')
+        assert sorted(results.keys()) == sorted(HOSTS.keys())
+        for locale, result in results.items():
+            assert result.result().Items.Item.ASIN == HOSTS[locale][0]
+
+    def test_partial_failures_are_preserved(self):
+        api = MultiLocaleAPI('', '', ['de', 'uk'],
+                             pool=LocalePool(HOSTS['uk'][0]))
+        results = api.item_lookup('0747532745')
+        assert results['de'].result().Items.Item.ASIN == HOSTS['de'][0]
+        assert isinstance(results['uk'].exception(), TooManyRequests)
+
+    def test_each_locale_has_own_budget(self):
+        api = MultiLocaleAPI('', '', ['de', 'uk'])
+        assert api.apis['de'].limiter is not api.apis['uk'].limiter
+        assert api.apis['de'].limiter is MultiLocaleAPI('', '').apis['de'].limiter
+
+    def test_unsupported_operations(self):
+        api = MultiLocaleAPI('', '', ['de', 'uk'])
+        pytest.raises(AttributeError, getattr, api, 'cart_create')
+
+
+class SlowLookupAPI (SingleFlightAPI):
+
+    """
+    Answers ``ItemLookup`` requests like ``ItemLookupAPI`` but only after
+    ``release`` has been set.
+    """
+
+    RESPONSE = ItemLookupAPI.RESPONSE
+    ERROR = ItemLookupAPI.ERROR
+    ITEM = ItemLookupAPI.ITEM
+
+    def __init__(self, *args, **kwargs):
+        SingleFlightAPI.__init__(self, *args, **kwargs)
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.requests = []
+
+    def _fetch(self, url):
+        self.fetching.set()
+        self.release.wait()
+        return ItemLookupAPI._fetch.im_func(self, url)
+
+
+class TestSingleFlightAPI (object):
+
+    """
+    Test that identical concurrent requests are only sent once.
+    """
+
+    def setup_method(self, method):
+        self.api = SlowLookupAPI('', '', 'de', limiter=TokenBucket(1000, 100))
+
+    def lookup_concurrently(self, id, n=5):
+        results = []
+        def lookup():
+            try:
+                results.append(self.api.item_lookup(id))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=lookup) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        # give other threads time to join the request in flight
+        self.api.fetching.wait(5)
+        time.sleep(.1)
+        self.api.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_requests_are_merged(self):
+        results = self.lookup_concurrently('0747532745')
+        assert self.api.requests == [['0747532745']]
+        assert len(results) == 5
+        for root in results:
+            assert root is results[0]
+        assert results[0].Items.Item.ASIN == '0747532745'
+        assert self.api._flights == {}
+
+    def test_exceptions_are_shared(self):
+        results = self.lookup_concurrently('X747532745')
+        assert self.api.requests == [['X747532745']]
+        assert len(results) == 5
+        for e in results:
+            assert isinstance(e, InvalidParameterValue)
+        assert self.api._flights == {}
+
+    def test_subsequent_requests_are_sent_again(self):
+        self.api.release.set()
+        self.api.item_lookup('0747532745')
+        self.api.item_lookup('0747532745')
+        self.api.item_lookup('0201896834')
+        assert len(self.api.requests) == 3
+
+    def test_key_ignores_signature_and_empty_params(self):
+        key = SingleFlightAPI.get_key
+        assert key({'ItemId' : '1', 'Timestamp' : 'now', 'Signature' : 'x',
+                    'ResponseGroup' : None}) == key({'ItemId' : '1'})
+        assert key({'ItemId' : '1'}) != key({'ItemId' : '2'})
+
+
+class CountingPool (LocalePool):
+
+    """
+    Connection pool counting requests.
+    """
+
+    def __init__(self, *failing):
+        LocalePool.__init__(self, *failing)
+        self.requests = 0
+
+    def urlopen(self, url, headers=None, debuglevel=0):
+        self.requests += 1
+        return LocalePool.urlopen(self, url, headers, debuglevel)
+
+
+class TestResponseCachingAPI (object):
+
+    """
+    Test that responses are cached as they are.
+    """
+
+    def setup_method(self, method):
+        self.pool = CountingPool()
+
+    def test_responses_are_cached(self, tmpdir):
+        api = ResponseCachingAPI('', '', 'de', cachedir=str(tmpdir),
+                                 pool=self.pool)
+        for i in range(3):
+            root = api.item_lookup('0747532745')
+            assert root.Items.Item.ASIN == HOSTS['de'][0]
+        assert self.pool.requests == 1
+        [path] = tmpdir.listdir()
+        assert path.read() == LocalePool.RESPONSE % HOSTS['de'][0]
+
+    def test_fetch_returns_file_like_object(self, tmpdir):
+        api = ResponseCachingAPI('', '', 'de', cachedir=str(tmpdir),
+                                 pool=self.pool)
+        url = api._build_url(Operation='ItemLookup', ItemId='0747532745')
+        assert api._fetch(url).read() == api._fetch_data(url)
+        assert self.pool.requests == 1
+
+    def test_lazy_responses_are_cached(self, tmpdir):
+        api = ResponseCachingAPI('', '', 'de', cachedir=str(tmpdir),
+                                 pool=self.pool, lazy=True)
+        for i in range(3):
+            root = api.item_lookup('0747532745')
+            assert root.Items.Item.ASIN == HOSTS['de'][0]
+        assert self.pool.requests == 1
+
+    def test_caching_can_be_disabled(self):
+        api = ResponseCachingAPI('', '', 'de', cachedir=None, pool=self.pool)
+        api.item_lookup('0747532745')
+        api.item_lookup('0747532745')
+        assert self.pool.requests == 2
+
+
+class TestParseData (object):
+
+    """
+    Test parsing responses from strings.
+    """
+
+    def test_fetch_data(self):
+        api = API('', '', 'de', pool=LocalePool())
+        url = api._build_url(Operation='ItemLookup', ItemId='0747532745')
+        assert api._fetch_data(url) == LocalePool.RESPONSE % HOSTS['de'][0]
+
+    def test_parse_data(self):
+        api = API('', '', 'de')
+        data = LocalePool.RESPONSE % 'X'
+        for buf in (data, memoryview(data), bytearray(data), buffer(data)):
+            assert api._parse_data(buf).Items.Item.ASIN == 'X'
+
+    def test_errors_are_converted(self):
+        api = API('', '', 'de')
+        data = ItemLookupAPI.RESPONSE % (ItemLookupAPI.ERROR % 'X', '')
+        pytest.raises(InvalidParameterValue, api._parse_data, data)
+
+    def test_processors_without_fromstring(self):
+        api = API('', '', 'de', processor=lambda fp: fp.read())
+        assert api._parse_data(memoryview('<xml/>')) == '<xml/>'
+
+
+class TestLazyResponses (object):
+
+    """
+    Test that lazy responses are only parsed when needed.
+    """
+
+    def setup_method(self, method):
+        self.api = API('', '', 'de', pool=LocalePool(), lazy=True)
+
+    def test_response_is_parsed_on_access(self):
+        result = self.api.item_lookup('0747532745')
+        assert isinstance(result, LazyResponse)
+        assert not result.parsed()
+        assert result.data == LocalePool.RESPONSE % HOSTS['de'][0]
+        assert str(result) == result.data
+        assert not result.parsed()
+        assert result.Items.Item.ASIN == HOSTS['de'][0]
+        assert result.parsed()
+        assert result.root is result.root
+
+    def test_parse_data_can_be_overridden(self):
+        # lazy responses are parsed with _parse_data() (not _parse())
+        class CustomAPI (API):
+            def _parse(self, fp):
+                raise AssertionError('_parse() is not used in lazy mode')
+            def _parse_data(self, data):
+                return 'parsed %i bytes' % len(data)
+        api = CustomAPI('', '', 'de', pool=LocalePool(), lazy=True)
+        result = api.item_lookup('0747532745')
+        assert result.root == 'parsed %i bytes' % len(result.data)
+
+    def test_errors_are_raised_right_away(self):
+        api = ItemLookupAPI('', '', 'de', lazy=True,
+                            limiter=TokenBucket(1000, 100))
+        pytest.raises(InvalidParameterValue, api.item_lookup, 'X747532745')
+
+    def test_item_lookup_many(self):
+        api = ItemLookupAPI('', '', 'de', lazy=True,
+                            limiter=TokenBucket(1000, 100))
+        items, invalid = api.item_lookup_many(['0747532745', 'X747532745'])
+        assert items.keys() == ['0747532745']
+        assert invalid == ['X747532745']
+
+    def test_error_pre_check_finds_all_errors(self):
+        from amazonproduct.processors import LxmlObjectifyProcessor
+        processor = LxmlObjectifyProcessor()
+        for version in TESTABLE_API_VERSIONS:
+            folder = os.path.join(XML_TEST_DIR, version)
+            for name in os.listdir(folder):
+                if not name.endswith('.xml'):
+                    continue
+                data = open(os.path.join(folder, name)).read()
+                try:
+                    processor.fromstring(data)
+                except AWSError:
+                    assert '<Error>' in data, name
+
+
 class TestAPICallsWithOptionalParameters (object):
 
     """
@@ -81,6 +787,102 @@ class TestAPICallsWithOptionalParameters (object):
         assert qs['AssociateTag'][0] == tag
 
 
+def reference_url(api, **qargs):
+    """
+    Signs URL the way ``API._build_url`` originally did (without caching).
+    """
+    qargs = dict((key, val) for key, val in qargs.items() if val is not None)
+    qargs.setdefault('AWSAccessKeyId', api.access_key)
+    qargs.setdefault('Service', 'AWSECommerceService')
+    qargs.setdefault('Version', api.VERSION)
+    if api.associate_tag:
+        qargs.setdefault('AssociateTag', api.associate_tag)
+    args = '&'.join(['%s=%s' % (key, quote(unicode(qargs[key])
+                    .encode('utf-8'), safe='~')) for key in sorted(qargs)])
+    host = api.host['Style' in qargs]
+    msg = 'GET\n%s\n/onca/xml\n%s' % (host, args)
+    signature = quote(b64encode(hmac.new(api.secret_key, msg,
+                                         hashlib.sha256).digest()))
+    return 'http://%s/onca/xml?%s&Signature=%s' % (host, args, signature)
+
+
+class TestURLSigning (object):
+
+    """
+    Test that cached signing context produces correctly signed URLs.
+    """
+
+    def setup_method(self, method):
+        self.api = API('AKIAEXAMPLE', 'SECRET', 'de', associate_tag='tag-21')
+
+    def check(self, **qargs):
+        url = self.api._build_url(**qargs)
+        timestamp = parse_qs(urlparse(url)[4])['Timestamp'][0]
+        assert url == reference_url(self.api, Timestamp=timestamp, **qargs)
+
+    def test_urls_are_signed_correctly(self):
+        self.check(Operation='ItemSearch', SearchIndex='Books',
+                   Author=u'F\xe9lix J. Palma', ItemPage=2)
+        self.check(Operation='ItemLookup', ItemId='0747532745,0201896834',
+                   ResponseGroup=None, AssociateTag=None)
+        self.check(Operation='ItemLookup', ItemId='0747532745',
+                   Style='http://example.com/style.xsl')
+        self.check(Operation='ItemLookup', ItemId='0747532745',
+                   Version='2009-10-01', AssociateTag='other-21')
+
+    def test_context_is_reused(self):
+        context = self.api._signing_context()
+        self.api._build_url(Operation='Help')
+        assert self.api._signing_context() is context
+
+    def test_context_changes_with_settings(self):
+        context = self.api._signing_context()
+        self.api.VERSION = '2009-10-01'
+        assert self.api._signing_context() is not context
+        self.check(Operation='ItemLookup', ItemId='0747532745')
+        assert 'Version=2009-10-01' in self.api._build_url(Operation='Help')
+
+    def test_build_urls(self):
+        params = [
+            {'Operation' : 'ItemLookup', 'ItemId' : '0747532745'},
+            {'Operation' : 'ItemLookup', 'ItemId' : '0201896834',
+             'ResponseGroup' : None},
+            {'Operation' : 'ItemSearch', 'SearchIndex' : 'Books',
+             'Author' : u'F\xe9lix J. Palma'},
+            {'Operation' : 'ItemLookup', 'ItemId' : '0747532745',
+             'Style' : 'http://example.com/style.xsl'},
+        ]
+        urls = self.api.build_urls(params)
+        assert len(urls) == len(params)
+        timestamps = set(parse_qs(urlparse(url)[4])['Timestamp'][0]
+                         for url in urls)
+        assert len(timestamps) == 1
+        timestamp = timestamps.pop()
+        for url, qargs in zip(urls, params):
+            assert url == reference_url(self.api, Timestamp=timestamp, **qargs)
+
+    def test_build_urls_with_empty_list(self):
+        assert self.api.build_urls([]) == []
+
+    def test_equal_values_of_different_types(self):
+        # 1, 1.0 and True are equal but must not share a quoted value
+        params = [{'Operation' : 'ItemSearch', 'ItemPage' : val}
+                  for val in (1, True, 1.0)]
+        urls = self.api.build_urls(params)
+        pages = [parse_qs(urlparse(url)[4])['ItemPage'][0] for url in urls]
+        assert pages == ['1', 'True', '1.0']
+
+    def test_unhashable_values(self):
+        class Value (list):
+            def __unicode__(self):
+                return u','.join(self)
+        params = [{'Operation' : 'ItemLookup',
+                   'ItemId' : Value(['0747532745', '0201896834'])}] * 2
+        for url in self.api.build_urls(params):
+            qs = parse_qs(urlparse(url)[4])
+            assert qs['ItemId'][0] == '0747532745,0201896834'
+
+
 def pytest_generate_tests(metafunc):
     # called once per each test function
     if 'api' in metafunc.funcargnames and 'operation' in metafunc.funcargnames:
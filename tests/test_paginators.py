@@ -0,0 +1,624 @@
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import pytest
+from StringIO import StringIO
+import urlparse
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.api import API, AsyncAPI, LazyResponse
+from amazonproduct.errors import AWSError
+from amazonproduct.paginators import BaseResultPaginator
+from amazonproduct.paginators import FileCheckpointStore
+from amazonproduct.processors import LxmlObjectifyProcessor
+from amazonproduct.processors import LxmlEtreeProcessor
+from amazonproduct.processors import ExpatProcessor
+from amazonproduct.processors import LxmlIterparseProcessor
+from amazonproduct.throttling import TokenBucket
+
+NS = 'http://webservices.amazon.com/AWSECommerceService/2010-12-01'
+
+#: parameters used for pagination
+COUNTERS = ('ItemPage', 'ReviewPage', 'OfferPage', 'VariationPage')
+
+#: ten pages of ItemSearch results (of 28)
+PAGINATION = os.path.join(XML_TEST_DIR, '2009-10-01',
+                          'ResultPaginator-de-itemsearch-pagination.xml')
+
+
+class PageFileAPI (API):
+
+    """
+    Answers requests for page ``n`` (of any operation) with the contents of
+    file ``path-n`` (or ``path`` for the first page). Requests can be slowed
+    down by ``delay`` seconds to simulate network latency. Like the real
+    thing, every request waits for the rate limiter.
+    """
+
+    def __init__(self, path, delay=0, **kwargs):
+        kwargs.setdefault('limiter', TokenBucket(1000, 100))
+        API.__init__(self, '', '', 'de', **kwargs)
+        self.path = path
+        self.delay = delay
+        self.requested = []
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, url):
+        params = dict(urlparse.parse_qsl(urlparse.urlparse(url)[4]))
+        index = 1
+        for counter in COUNTERS:
+            if counter in params:
+                index = int(params[counter])
+        self.limiter.acquire()
+        self._lock.acquire()
+        try:
+            self.requested.append(index)
+            self.in_flight += 1
+            self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        finally:
+            self._lock.release()
+        try:
+            time.sleep(self.delay)
+        finally:
+            self._lock.acquire()
+            self.in_flight -= 1
+            self._lock.release()
+        return self._open(index)
+
+    def _open(self, index):
+        path = self.path
+        if index > 1:
+            head, tail = os.path.splitext(self.path)
+            path = head + '-%i' % index + tail
+        return open(path)
+
+
+class TemplateAPI (PageFileAPI):
+
+    """
+    Answers requests with ``template`` filled in with the requested page
+    ``index``.
+    """
+
+    def __init__(self, template, **kwargs):
+        PageFileAPI.__init__(self, None, **kwargs)
+        self.template = template
+
+    def _open(self, index):
+        return StringIO(self.template % {'index' : index})
+
+
+class CountingPaginator (BaseResultPaginator):
+
+    """
+    Paginator over "pages" which are simply their own index.
+    """
+
+    def __init__(self, fun, pages, **kwargs):
+        self.total = pages
+        BaseResultPaginator.__init__(self, fun, (), kwargs, 'Page')
+
+    def extract_data(self, page):
+        return page, self.total, self.total * 10
+
+
+def pages(fun=None):
+    """
+    Returns function returning the requested page index (or the result of
+    ``fun(index)`` if specified).
+    """
+    def fetch(**params):
+        if fun is not None:
+            return fun(params['Page'])
+        return params['Page']
+    return fetch
+
+
+class TestPrefetchingPaginator (object):
+
+    """
+    Test that pages can be fetched concurrently but are yielded in order.
+    """
+
+    def test_pages_are_yielded_in_order(self):
+        for processor in (LxmlObjectifyProcessor(), LxmlEtreeProcessor(),
+                          ExpatProcessor()):
+            expected = None
+            for prefetch in (0, 1, 4, 20):
+                api = PageFileAPI(PAGINATION, processor=processor)
+                paginator = api.item_search('Books', Publisher='Galileo Press',
+                                            limit=10, prefetch=prefetch)
+                result = [(paginator.current, paginator.pages)
+                          for root in paginator]
+                assert sorted(api.requested) == range(1, 11)
+                if expected is None:
+                    expected = result
+                assert result == expected
+            assert expected == [(i, 28) for i in range(1, 11)]
+
+    @pytest.mark.slowtest
+    def test_pages_are_fetched_concurrently(self):
+        api = PageFileAPI(PAGINATION, delay=.1)
+        paginator = api.item_search('Books', Publisher='Galileo Press',
+                                    limit=10, prefetch=3)
+        start = time.time()
+        assert len(list(paginator)) == 10
+        # 1 + 3 batches of 3 pages
+        assert time.time() - start < .6
+        assert api.max_in_flight == 3
+
+    @pytest.mark.slowtest
+    def test_requests_are_throttled(self):
+        api = PageFileAPI(PAGINATION, limiter=TokenBucket(rate=20, burst=1))
+        paginator = api.item_search('Books', Publisher='Galileo Press',
+                                    limit=10, prefetch=5)
+        start = time.time()
+        assert len(list(paginator)) == 10
+        assert time.time() - start >= 9 / 20.0 - .05
+
+    @pytest.mark.slowtest
+    def test_prefetch_window_is_bounded(self):
+        fetched = []
+        def fetch(index):
+            fetched.append(index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 100, prefetch=3)
+        iterator = iter(paginator)
+        assert iterator.next() == 1
+        assert iterator.next() == 2
+        time.sleep(.1)
+        assert max(fetched) <= 2 + 3
+
+    def test_errors_are_raised_in_order(self):
+        def fetch(index):
+            if index == 4:
+                raise AWSError('AWS.Test', 'Page %i failed' % index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 10, prefetch=3)
+        result = []
+        e = pytest.raises(AWSError, lambda: [result.append(page)
+                                             for page in paginator]).value
+        assert result == [1, 2, 3]
+        assert e.msg == 'Page 4 failed'
+
+
+class TestReadAheadPaginator (object):
+
+    """
+    Test that pages are fetched in the background while the current one is
+    being processed.
+    """
+
+    def test_pages_are_yielded_in_order(self):
+        for processor in (LxmlObjectifyProcessor(), ExpatProcessor()):
+            api = PageFileAPI(PAGINATION, processor=processor)
+            paginator = api.item_search('Books', Publisher='Galileo Press',
+                                        limit=10, read_ahead=2)
+            assert [(paginator.current, paginator.pages)
+                    for root in paginator] == [(i, 28) for i in range(1, 11)]
+            assert api.requested == range(1, 11)
+
+    @pytest.mark.slowtest
+    def test_fetching_overlaps_processing(self):
+        api = PageFileAPI(PAGINATION, delay=.05)
+        paginator = api.item_search('Books', Publisher='Galileo Press',
+                                    limit=10, read_ahead=1)
+        start = time.time()
+        for root in paginator:
+            time.sleep(.05) # processing
+        # serially, this would take 10 * (.05 + .05) seconds
+        assert time.time() - start < .8
+        assert api.max_in_flight == 1
+
+    @pytest.mark.slowtest
+    def test_queue_is_bounded(self):
+        fetched = []
+        def fetch(index):
+            fetched.append(index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 100, read_ahead=2)
+        iterator = iter(paginator)
+        assert iterator.next() == 1
+        assert iterator.next() == 2
+        time.sleep(.1)
+        # two pages queued and one waiting to be queued
+        assert max(fetched) <= 2 + 2 + 1
+
+    @pytest.mark.slowtest
+    def test_abandoned_iteration_stops_reading(self):
+        fetched = []
+        def fetch(index):
+            fetched.append(index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 100, read_ahead=1)
+        for page in paginator:
+            if page == 3:
+                break
+        time.sleep(.3)
+        count = len(fetched)
+        time.sleep(.3)
+        assert len(fetched) == count < 10
+
+    def test_errors_are_raised_in_order(self):
+        def fetch(index):
+            if index == 4:
+                raise AWSError('AWS.Test', 'Page %i failed' % index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 10, read_ahead=3)
+        result = []
+        e = pytest.raises(AWSError, lambda: [result.append(page)
+                                             for page in paginator]).value
+        assert result == [1, 2, 3]
+        assert e.msg == 'Page 4 failed'
+
+    def test_prefetch_and_read_ahead_are_exclusive(self):
+        fetched = []
+        def fetch(index):
+            fetched.append(index)
+            return index
+        pytest.raises(ValueError, CountingPaginator, pages(fetch), 10,
+                      prefetch=2, read_ahead=2)
+        # nothing has been requested yet
+        assert fetched == []
+        # zero means "not used"
+        paginator = CountingPaginator(pages(fetch), 3, prefetch=2,
+                                      read_ahead=0)
+        assert list(paginator) == [1, 2, 3]
+
+
+class Page (object):
+
+    """
+    Result page with items ``(ASIN, index)``.
+    """
+
+    def __init__(self, index, asins):
+        self.index = index
+        self.items = [(asin, index) for asin in asins]
+
+
+class ItemPaginator (CountingPaginator):
+
+    def extract_data(self, page):
+        return page.index, self.total, self.total * 10
+
+    def items(self, page):
+        return page.items
+
+
+class TestItemIterator (object):
+
+    """
+    Test iterating over the items of all pages.
+    """
+
+    def test_items_of_all_pages(self):
+        for processor in (LxmlObjectifyProcessor(), LxmlEtreeProcessor(),
+                          ExpatProcessor()):
+            api = PageFileAPI(PAGINATION, processor=processor)
+            expected = []
+            for root in api.item_search('Books', Publisher='Galileo Press',
+                                        limit=10):
+                expected.extend([asin for asin, item in processor.items(root)])
+            assert len(expected) == 100
+
+            api = PageFileAPI(PAGINATION, processor=processor)
+            paginator = api.item_search('Books', Publisher='Galileo Press',
+                                        limit=10)
+            result = list(paginator.iter_items())
+            assert [asin for asin, item in result] == expected
+
+    def test_repeated_items_are_skipped(self):
+        asins = {1 : ['A', 'B', 'C'], 2 : ['C', 'D'], 3 : ['A', 'E']}
+        paginator = ItemPaginator(
+            pages(lambda index: Page(index, asins[index])), 3)
+        assert list(paginator.iter_items()) == [
+            ('A', 1), ('B', 1), ('C', 1), ('D', 2), ('E', 3)]
+
+    def test_pages_are_not_kept(self):
+        import weakref
+        refs = []
+        def fetch(index):
+            page = Page(index, ['A%i' % index, 'B%i' % index])
+            refs.append(weakref.ref(page))
+            return page
+        paginator = ItemPaginator(pages(fetch), 5)
+        for asin, index in paginator.iter_items():
+            # previous pages have been let go
+            alive = [ref().index for ref in refs if ref() is not None]
+            assert [i for i in alive if i < index] == []
+        assert len(refs) == 5
+
+    def test_iterating_twice_fetches_first_page_again(self):
+        fetched = []
+        def fetch(index):
+            fetched.append(index)
+            return index
+        paginator = CountingPaginator(pages(fetch), 3)
+        assert list(paginator) == [1, 2, 3]
+        assert list(paginator) == [1, 2, 3]
+        assert fetched == [1, 2, 3, 1, 2, 3]
+
+    def test_items_need_processor(self):
+        paginator = CountingPaginator(pages(), 3)
+        e = pytest.raises(TypeError, list, paginator.iter_items()).value
+        assert 'CountingPaginator has no response processor' in str(e)
+        paginator.processor = object()
+        e = pytest.raises(TypeError, list, paginator.iter_items()).value
+        assert 'object does not support extracting items' in str(e)
+
+
+class TestLazyResponses (object):
+
+    """
+    Test that paginators and ``items()`` work with ``API(..., lazy=True)``.
+    """
+
+    def test_items_of_lazy_response(self):
+        for processor in PROCESSORS:
+            processor = processor()
+            api = PageFileAPI(PAGINATION, processor=processor, lazy=True)
+            root = api.item_search('Books', Publisher='Galileo Press',
+                                   limit=1).page(1)
+            assert isinstance(root, LazyResponse)
+            assert len(processor.items(root)) == 10
+
+    def test_lazy_pages(self):
+        for processor in PROCESSORS:
+            for options in ({}, {'prefetch' : 2}, {'read_ahead' : 2}):
+                api = PageFileAPI(PAGINATION, processor=processor(),
+                                  lazy=True)
+                paginator = api.item_search('Books', limit=3,
+                                            Publisher='Galileo Press',
+                                            **options)
+                assert [(paginator.current, paginator.pages,
+                         isinstance(root, LazyResponse))
+                        for root in paginator] == [
+                    (i, 28, True) for i in range(1, 4)]
+
+                api = PageFileAPI(PAGINATION, processor=processor(),
+                                  lazy=True)
+                paginator = api.item_search('Books', limit=3,
+                                            Publisher='Galileo Press',
+                                            **options)
+                assert len(list(paginator.iter_items())) == 30
+
+
+class Crash (Exception):
+    pass
+
+
+class TestCheckpoints (object):
+
+    """
+    Test that interrupted paginations can be resumed.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp(prefix='checkpoints-')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+    def search(self, api, **kwargs):
+        return api.item_search('Books', Publisher='Galileo Press', limit=10,
+                               **kwargs)
+
+    def test_checkpoint_can_be_resumed(self):
+        try:
+            import json
+        except ImportError: # pragma: no cover
+            import simplejson as json
+        api = PageFileAPI(PAGINATION)
+        paginator = self.search(api)
+        for root in paginator:
+            if paginator.current == 4:
+                break
+        checkpoint = json.loads(json.dumps(paginator.checkpoint()))
+        assert checkpoint['current'] == 4
+        assert checkpoint['pages'] == 28
+
+        api = PageFileAPI(PAGINATION)
+        paginator = self.search(api, resume=checkpoint)
+        assert api.requested == []
+        assert [paginator.current for root in paginator] == range(5, 11)
+        assert api.requested == range(5, 11)
+
+    def test_checkpoint_must_match_query(self):
+        paginator = self.search(PageFileAPI(PAGINATION))
+        checkpoint = paginator.checkpoint()
+        api = PageFileAPI(PAGINATION)
+        pytest.raises(ValueError, api.item_search, 'Books',
+                      Publisher='O\'Reilly', limit=10, resume=checkpoint)
+
+    def test_crawl_continues_after_crash(self):
+        for options in ({}, {'prefetch' : 3}, {'read_ahead' : 2}):
+            store = FileCheckpointStore(self.path)
+            processed, crashed = [], []
+            def process(paginator):
+                for root in paginator:
+                    if paginator.current == 6 and not crashed:
+                        crashed.append(True)
+                        raise Crash
+                    processed.append(paginator.current)
+
+            api = PageFileAPI(PAGINATION)
+            pytest.raises(Crash, process, self.search(api, checkpoints=store,
+                                                      **options))
+            assert processed == range(1, 6)
+
+            # restarted job (with a new store instance)
+            store = FileCheckpointStore(self.path)
+            api = PageFileAPI(PAGINATION)
+            process(self.search(api, checkpoints=store, **options))
+            assert processed == range(1, 11)
+            assert sorted(api.requested) == range(6, 11)
+
+            # checkpoint is removed once all pages are processed
+            assert os.listdir(self.path) == []
+
+    def test_other_queries_are_not_resumed(self):
+        store = {}
+        paginator = self.search(PageFileAPI(PAGINATION), checkpoints=store)
+        for root in paginator:
+            if paginator.current == 3:
+                break
+        assert len(store) == 1
+        api = PageFileAPI(PAGINATION)
+        paginator = api.item_search('Books', Publisher='Galileo Press',
+                                    limit=5, checkpoints=store)
+        assert api.requested == [1]
+        assert paginator.checkpoint_key() not in store
+
+    def test_shelve_can_be_used_as_store(self):
+        import shelve
+        store = shelve.open(os.path.join(self.path, 'checkpoints'))
+        try:
+            paginator = self.search(PageFileAPI(PAGINATION),
+                                    checkpoints=store)
+            for root in paginator:
+                if paginator.current == 3:
+                    break
+        finally:
+            store.close()
+        store = shelve.open(os.path.join(self.path, 'checkpoints'))
+        try:
+            api = PageFileAPI(PAGINATION)
+            paginator = self.search(api, checkpoints=store)
+            # page 3 has not been processed completely
+            assert paginator.current == 2
+            assert len(list(paginator)) == 8
+            assert len(store) == 0
+        finally:
+            store.close()
+
+
+#: ItemLookup response for page ``index`` of 3 offer pages
+OFFERS = """<?xml version="1.0" ?>
+<ItemLookupResponse xmlns="%s">
+  <Items>
+    <Request>
+      <IsValid>True</IsValid>
+      <ItemLookupRequest>
+        <ItemId>0747532745</ItemId>
+        <OfferPage>%%(index)i</OfferPage>
+        <ResponseGroup>Offers</ResponseGroup>
+        <ReviewPage>1</ReviewPage>
+        <VariationPage>All</VariationPage>
+      </ItemLookupRequest>
+    </Request>
+    <Item>
+      <ASIN>0747532745</ASIN>
+      <Offers>
+        <TotalOffers>23</TotalOffers>
+        <TotalOfferPages>3</TotalOfferPages>
+      </Offers>
+    </Item>
+  </Items>
+</ItemLookupResponse>""" % NS
+
+#: ItemLookup response for page ``index`` of 2 variation pages
+VARIATIONS = """<?xml version="1.0" ?>
+<ItemLookupResponse xmlns="%s">
+  <Items>
+    <Request>
+      <IsValid>True</IsValid>
+      <ItemLookupRequest>
+        <ItemId>B0028N7OO2</ItemId>
+        <OfferPage>1</OfferPage>
+        <ResponseGroup>Variations</ResponseGroup>
+        <ReviewPage>1</ReviewPage>
+        <VariationPage>%%(index)i</VariationPage>
+      </ItemLookupRequest>
+    </Request>
+    <Item>
+      <ASIN>B0028N7OO2</ASIN>
+      <Variations>
+        <TotalVariations>14</TotalVariations>
+        <TotalVariationPages>2</TotalVariationPages>
+      </Variations>
+    </Item>
+  </Items>
+</ItemLookupResponse>""" % NS
+
+#: three processors with a paginator for each paginated operation
+PROCESSORS = (LxmlObjectifyProcessor, LxmlEtreeProcessor, ExpatProcessor)
+
+
+class TestItemLookupPaginators (object):
+
+    """
+    Test paginators for reviews, offers and variations of an item.
+    """
+
+    def test_review_pagination(self):
+        path = os.path.join(XML_TEST_DIR, '2009-10-01',
+                            'ResultPaginator-de-review-pagination.xml')
+        for processor in PROCESSORS:
+            api = PageFileAPI(path, processor=processor())
+            paginator = api.item_reviews('0747532745', limit=10)
+            assert [(paginator.current, paginator.pages, paginator.results)
+                    for root in paginator] == [
+                (i, 492, 2458) for i in range(1, 11)]
+            assert api.requested == range(1, 11)
+
+    def test_pagination_works_for_missing_reviews(self):
+        path = os.path.join(XML_TEST_DIR, '2009-10-01',
+            'ResultPaginator-de-pagination-works-for-missing-reviews.xml')
+        for processor in PROCESSORS:
+            api = PageFileAPI(path, processor=processor())
+            assert len(list(api.item_reviews('B0039NM7Y2'))) == 1
+
+    def test_offer_pagination(self):
+        for processor in PROCESSORS:
+            api = TemplateAPI(OFFERS, processor=processor())
+            paginator = api.item_offers('0747532745', Condition='All')
+            assert [(paginator.current, paginator.pages, paginator.results)
+                    for root in paginator] == [(1, 3, 23), (2, 3, 23),
+                                               (3, 3, 23)]
+
+    def test_variation_pagination(self):
+        for processor in PROCESSORS:
+            api = TemplateAPI(VARIATIONS, processor=processor())
+            paginator = api.item_variations('B0028N7OO2')
+            assert [(paginator.current, paginator.pages, paginator.results)
+                    for root in paginator] == [(1, 2, 14), (2, 2, 14)]
+
+    def test_non_numeric_page_is_ignored(self):
+        # requests without VariationPage return <VariationPage>All</...>
+        data = VARIATIONS % {'index' : 1}
+        data = data.replace('<VariationPage>1<', '<VariationPage>All<')
+        for processor in PROCESSORS:
+            klass = processor.item_variations_paginator
+            # paginator without fetching the first page
+            paginator = klass.__new__(klass)
+            root = processor().fromstring(data)
+            assert list(paginator.extract_data(root)) == [1, 2, 14]
+
+    def test_errors_are_not_swallowed(self):
+        # an AttributeError while fetching the first page must not make the
+        # operation fall back to an unpaginated (second) request
+        class BrokenAPI (TemplateAPI):
+            def _open(self, index):
+                raise AttributeError('broken')
+        api = BrokenAPI(OFFERS)
+        pytest.raises(AttributeError, api.item_offers, '0747532745')
+        assert api.requested == [1]
+
+    def test_processor_without_paginator(self):
+        api = TemplateAPI(OFFERS, processor=LxmlIterparseProcessor())
+        result = api.item_offers('0747532745')
+        assert not isinstance(result, BaseResultPaginator)
+        assert api.requested == [1]
+
+    def test_async_api(self):
+        api = AsyncAPI('', '', 'de', limiter=TokenBucket(1000, 100))
+        api._fetch = lambda url: StringIO(OFFERS % {'index' : int(
+            dict(urlparse.parse_qsl(urlparse.urlparse(url)[4]))['OfferPage'])})
+        paginator = api.item_offers('0747532745').result()
+        assert len(list(paginator)) == 3
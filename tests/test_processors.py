@@ -0,0 +1,308 @@
+
+import os
+import pytest
+from StringIO import StringIO
+
+from tests import XML_TEST_DIR, TESTABLE_API_VERSIONS
+
+from amazonproduct.api import API
+from amazonproduct.errors import AWSError, InvalidParameterValue
+from amazonproduct.processors import LxmlObjectifyProcessor
+from amazonproduct.processors import LxmlIterparseProcessor
+from amazonproduct.processors import LxmlEtreeProcessor
+from amazonproduct.processors import ExpatProcessor
+from amazonproduct.processors import find_errors
+
+#: all stored XML responses
+ALL_RESPONSES = [os.path.join(XML_TEST_DIR, version, name)
+    for version in TESTABLE_API_VERSIONS
+    for name in sorted(os.listdir(os.path.join(XML_TEST_DIR, version)))
+    if name.endswith('.xml')]
+
+#: XML responses to operations returning items
+ITEM_RESPONSES = [os.path.join(XML_TEST_DIR, version, name)
+    for version in TESTABLE_API_VERSIONS
+    for name in sorted(os.listdir(os.path.join(XML_TEST_DIR, version)))
+    if name.split('-')[0] in ('ItemLookup', 'ItemSearch', 'SimilarityLookup')
+    and name.endswith('.xml')]
+
+
+def objectify_items(path):
+    """
+    Returns list of ASINs in response (or ``AWSError`` instance) using the
+    default processor.
+    """
+    processor = LxmlObjectifyProcessor()
+    try:
+        root = processor(open(path))
+    except AWSError, e:
+        return e
+    return [asin for asin, item in processor.items(root)]
+
+
+class FileAPI (API):
+
+    """
+    Answers every request with the contents of file ``path``. Subsequent
+    requests are answered with ``path-2``, ``path-3`` etc. if they exist.
+    """
+
+    def __init__(self, path, **kwargs):
+        API.__init__(self, '', '', 'de', **kwargs)
+        self.path = path
+        self.calls = 0
+
+    def _fetch(self, url):
+        self.calls += 1
+        head, tail = os.path.splitext(self.path)
+        path = head + '-%i' % self.calls + tail
+        if self.calls == 1 or not os.path.exists(path):
+            path = self.path
+        return open(path)
+
+
+class TestFindErrors (object):
+
+    """
+    Test that targeted error detection finds the same errors as a full scan.
+    """
+
+    def test_all_errors_are_found(self):
+        from lxml import etree
+        for path in ALL_RESPONSES:
+            root = etree.parse(path).getroot()
+            nspace = root.nsmap.get(None, '')
+            expected = root.xpath('//aws:Error', namespaces={'aws' : nspace})
+            assert find_errors(root) == expected, path
+
+    def test_multi_operation_errors_are_found(self):
+        from lxml import etree
+        root = etree.fromstring(MULTI_OPERATION_RESPONSE)
+        errors = find_errors(root)
+        assert [error.findtext('{*}Code') for error in errors] == [
+            'AWS.InvalidParameterValue', 'AWS.ECommerceService.NoSimilarities']
+
+
+    def test_multi_operation_errors_are_raised(self):
+        for processor in (LxmlObjectifyProcessor(), LxmlEtreeProcessor(),
+                          ExpatProcessor()):
+            for parse, source in [
+                    (processor, StringIO(MULTI_OPERATION_RESPONSE)),
+                    (processor.fromstring, MULTI_OPERATION_RESPONSE)]:
+                e = pytest.raises(AWSError, parse, source).value
+                assert e.code == 'AWS.InvalidParameterValue', processor
+
+
+NS = 'http://webservices.amazon.com/AWSECommerceService/2010-12-01'
+
+MULTI_OPERATION_RESPONSE = """<MultiOperationResponse
+  xmlns="http://webservices.amazon.com/AWSECommerceService/2010-12-01">
+  <ItemLookupResponse><Items><Request><IsValid>True</IsValid><Errors><Error>
+    <Code>AWS.InvalidParameterValue</Code><Message>Invalid id.</Message>
+  </Error></Errors></Request></Items></ItemLookupResponse>
+  <SimilarityLookupResponse><Items><Request><IsValid>True</IsValid><Errors>
+    <Error><Code>AWS.ECommerceService.NoSimilarities</Code>
+    <Message>No similar items.</Message></Error>
+  </Errors></Request></Items></SimilarityLookupResponse>
+</MultiOperationResponse>"""
+
+
+class TestLxmlIterparseProcessor (object):
+
+    """
+    Test streaming processor yielding items one by one.
+    """
+
+    def setup_method(self, method):
+        self.processor = LxmlIterparseProcessor()
+
+    def test_items_match_objectify_processor(self):
+        assert ITEM_RESPONSES
+        for path in ITEM_RESPONSES:
+            expected = objectify_items(path)
+            if isinstance(expected, AWSError):
+                e = pytest.raises(AWSError, self.processor, open(path)).value
+                assert (e.code, e.msg) == (expected.code, expected.msg)
+            else:
+                asins = [item.findtext('{*}ASIN')
+                         for item in self.processor(open(path))]
+                assert asins == expected, path
+
+    def test_items_are_cleared_after_use(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        items = []
+        for item in self.processor(open(path)):
+            assert item.findtext('{*}ASIN')
+            # previous items have been removed from the tree
+            assert item.getprevious() is None
+            items.append(item)
+        assert len(items) > 1
+        for item in items:
+            assert len(item) == 0
+
+    def test_items_method_copies_items(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        items = self.processor.items(self.processor(open(path)))
+        assert [asin for asin, item in items] == objectify_items(path)
+        for asin, item in items:
+            assert item.findtext('{*}ASIN') == asin
+
+    def test_fromstring(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        data = open(path).read()
+        asins = [item.findtext('{*}ASIN')
+                 for item in self.processor.fromstring(memoryview(data))]
+        assert asins == objectify_items(path)
+
+    def test_errors_are_raised_by_api_call(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemLookup-de-invalid-item-id.xml')
+        api = FileAPI(path, processor=self.processor)
+        pytest.raises(InvalidParameterValue, api.item_lookup, 'XXXXXXXXXX')
+
+
+class TestLxmlEtreeProcessor (object):
+
+    """
+    Test processor using plain lxml.etree.
+    """
+
+    def setup_method(self, method):
+        self.processor = LxmlEtreeProcessor()
+
+    def test_items_match_objectify_processor(self):
+        for path in ITEM_RESPONSES:
+            expected = objectify_items(path)
+            if isinstance(expected, AWSError):
+                e = pytest.raises(AWSError, self.processor, open(path)).value
+                assert (e.code, e.msg) == (expected.code, expected.msg)
+            else:
+                root = self.processor(open(path))
+                asins = [asin for asin, item in self.processor.items(root)]
+                assert asins == expected, path
+
+    def test_fromstring(self):
+        for path in ITEM_RESPONSES:
+            data = open(path).read()
+            expected = objectify_items(path)
+            for buf in (data, memoryview(data)):
+                if isinstance(expected, AWSError):
+                    pytest.raises(AWSError, self.processor.fromstring, buf)
+                else:
+                    root = self.processor.fromstring(buf)
+                    assert [asin for asin, item in
+                            self.processor.items(root)] == expected
+
+    def test_typed_accessors(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        root = self.processor(open(path))
+        processor = self.processor
+        assert processor.get_int(root, '//aws:Items/aws:TotalResults') == 740
+        assert processor.get_float(root, '//aws:Items/aws:TotalPages') == 74.0
+        assert processor.get_bool(root, '//aws:Items/aws:Request/aws:IsValid')
+        assert processor.get_text(root, '//aws:Arguments/aws:Argument'
+                                  '[@Name="Operation"]/@Value') == 'ItemSearch'
+        assert processor.get_int(root, '//aws:Missing') is None
+        assert processor.get_text(root, '//aws:Missing', 'n/a') == 'n/a'
+
+    def test_xpath_expressions_are_compiled_once(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        from amazonproduct import processors
+        root = self.processor(open(path))
+        self.processor.items(root)
+        compiled = len(processors._compiled)
+        for i in range(3):
+            root = self.processor(open(path))
+            self.processor.items(root)
+        assert len(processors._compiled) == compiled
+        nspace = root.nsmap.get(None, '')
+        assert self.processor.compile(nspace, self.processor.ITEMS) is \
+               processors.compile_xpath(nspace, self.processor.ITEMS, False)
+
+    def test_pagination(self):
+        path = os.path.join(XML_TEST_DIR, '2009-10-01',
+            'ResultPaginator-de-itemsearch-over-all-is-limited-to-five.xml')
+        pages = {}
+        for processor in (LxmlObjectifyProcessor(), self.processor):
+            api = FileAPI(path, processor=processor)
+            paginator = api.item_search('All', Keywords='Michael Jackson')
+            pages[processor.__class__] = [
+                (paginator.current, paginator.pages, paginator.results)
+                for root in paginator]
+        assert len(pages[LxmlEtreeProcessor]) == 5
+        assert pages[LxmlEtreeProcessor] == pages[LxmlObjectifyProcessor]
+
+
+class TestExpatProcessor (object):
+
+    """
+    Test processor using only the standard library.
+    """
+
+    def setup_method(self, method):
+        self.processor = ExpatProcessor()
+
+    def test_items_match_objectify_processor(self):
+        for path in ITEM_RESPONSES:
+            expected = objectify_items(path)
+            data = open(path).read()
+            if isinstance(expected, AWSError):
+                for parse, source in [(self.processor, StringIO(data)),
+                                      (self.processor.fromstring, data)]:
+                    e = pytest.raises(AWSError, parse, source).value
+                    assert (e.code, e.msg) == (expected.code, expected.msg)
+            else:
+                for root in [self.processor(StringIO(data)),
+                             self.processor.fromstring(data)]:
+                    assert [asin for asin, item in
+                            self.processor.items(root)] == expected, path
+
+    def test_all_errors_are_found(self):
+        for path in ALL_RESPONSES:
+            try:
+                expected = LxmlEtreeProcessor()(open(path))
+            except AWSError, expected:
+                pass
+            except Exception:
+                # responses without namespace cannot be handled by lxml
+                continue
+            if isinstance(expected, AWSError):
+                e = pytest.raises(AWSError, self.processor, open(path)).value
+                assert (e.code, e.msg) == (expected.code, expected.msg)
+            else:
+                self.processor(open(path))
+
+    def test_paths_are_qualified(self):
+        root = self.processor.parse(
+            StringIO(MULTI_OPERATION_RESPONSE)).getroot()
+        nspace = '{%s}' % NS
+        assert self.processor.path(root, 'Items/*/Errors') == (
+            nspace + 'Items/*/' + nspace + 'Errors')
+
+    def test_split(self):
+        for processor in (LxmlObjectifyProcessor(), LxmlEtreeProcessor(),
+                          self.processor):
+            results = processor.split(StringIO(MULTI_OPERATION_RESPONSE))
+            assert [operation for operation, result in results] == [
+                'ItemLookup', 'SimilarityLookup']
+            assert [result.code for operation, result in results] == [
+                'AWS.InvalidParameterValue',
+                'AWS.ECommerceService.NoSimilarities']
+
+    def test_pagination(self):
+        path = os.path.join(XML_TEST_DIR, '2009-10-01',
+            'ResultPaginator-de-itemsearch-over-all-is-limited-to-five.xml')
+        pages = {}
+        for processor in (LxmlObjectifyProcessor(), self.processor):
+            api = FileAPI(path, processor=processor)
+            paginator = api.item_search('All', Keywords='Michael Jackson')
+            pages[processor.__class__] = [
+                (paginator.current, paginator.pages, paginator.results)
+                for root in paginator]
+        assert len(pages[ExpatProcessor]) == 5
+        assert pages[ExpatProcessor] == pages[LxmlObjectifyProcessor]
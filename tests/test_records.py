@@ -0,0 +1,151 @@
+
+import os
+import pickle
+import pytest
+import tempfile
+
+from tests import XML_TEST_DIR
+
+from amazonproduct.processors import LxmlObjectifyProcessor
+from amazonproduct.processors import LxmlEtreeProcessor
+from amazonproduct.processors import LxmlIterparseProcessor
+from amazonproduct.records import ItemRecord, ItemExtractor
+
+LARGE_RESPONSE = '''<?xml version="1.0" ?>
+<ItemLookupResponse
+  xmlns="http://webservices.amazon.com/AWSECommerceService/2010-12-01">
+  <Items>
+    <Request><IsValid>True</IsValid></Request>
+    <Item>
+      <ASIN>0201896834</ASIN>
+      <SalesRank>18754</SalesRank>
+      <SmallImage><URL>http://example.com/small.jpg</URL></SmallImage>
+      <MediumImage><URL>http://example.com/medium.jpg</URL></MediumImage>
+      <LargeImage><URL>http://example.com/large.jpg</URL></LargeImage>
+      <ItemAttributes>
+        <Binding>Hardcover</Binding>
+        <ListPrice>
+          <Amount>6999</Amount>
+          <CurrencyCode>USD</CurrencyCode>
+          <FormattedPrice>$69.99</FormattedPrice>
+        </ListPrice>
+        <Title>Art of Computer Programming, Volume 1</Title>
+      </ItemAttributes>
+      <OfferSummary>
+        <LowestNewPrice>
+          <Amount>4630</Amount>
+          <CurrencyCode>USD</CurrencyCode>
+        </LowestNewPrice>
+        <LowestUsedPrice>
+          <CurrencyCode>USD</CurrencyCode>
+          <FormattedPrice>Too low to display</FormattedPrice>
+        </LowestUsedPrice>
+      </OfferSummary>
+      <BrowseNodes>
+        <BrowseNode>
+          <BrowseNodeId>3952</BrowseNodeId>
+          <Ancestors>
+            <BrowseNode><BrowseNodeId>5</BrowseNodeId></BrowseNode>
+          </Ancestors>
+        </BrowseNode>
+        <BrowseNode><BrowseNodeId>3970</BrowseNodeId></BrowseNode>
+      </BrowseNodes>
+    </Item>
+    <Item>
+      <ASIN>0201896842</ASIN>
+    </Item>
+  </Items>
+</ItemLookupResponse>
+'''
+
+EXPECTED = ItemRecord(
+    asin='0201896834',
+    title='Art of Computer Programming, Volume 1',
+    binding='Hardcover',
+    list_price=(6999, 'USD'),
+    lowest_new_price=(4630, 'USD'),
+    sales_rank=18754,
+    small_image='http://example.com/small.jpg',
+    medium_image='http://example.com/medium.jpg',
+    large_image='http://example.com/large.jpg',
+    browse_nodes=('3952', '3970'))
+
+
+class TestItemExtractor (object):
+
+    """
+    Test extracting compact item records from responses.
+    """
+
+    def setup_method(self, method):
+        self.extract = ItemExtractor()
+        fd, self.path = tempfile.mkstemp(suffix='.xml')
+        os.write(fd, LARGE_RESPONSE)
+        os.close(fd)
+
+    def teardown_method(self, method):
+        os.remove(self.path)
+
+    def test_extract_from_objectify_and_etree_trees(self):
+        for processor in (LxmlObjectifyProcessor(), LxmlEtreeProcessor()):
+            records = self.extract(processor(open(self.path)))
+            assert records == [EXPECTED, ItemRecord('0201896842')]
+
+    def test_extract_from_streamed_items(self):
+        items = LxmlIterparseProcessor()(open(self.path))
+        records = [self.extract.record(item) for item in items]
+        assert records == [EXPECTED, ItemRecord('0201896842')]
+
+    def test_extract_from_stored_responses(self):
+        path = os.path.join(XML_TEST_DIR, '2010-12-01',
+                            'ItemSearch-de-lookup-by-title.xml')
+        processor = LxmlObjectifyProcessor()
+        root = processor(open(path))
+        records = self.extract(root)
+        assert len(records) == 10
+        for record, (asin, item) in zip(records, processor.items(root)):
+            assert record.asin == asin
+            assert record.title == item.ItemAttributes.Title.text
+
+
+class TestItemRecord (object):
+
+    """
+    Test that item records are compact, immutable, picklable and comparable.
+    """
+
+    def test_defaults(self):
+        record = ItemRecord('0201896834')
+        assert record.asin == '0201896834'
+        assert record.title is None
+        assert record.browse_nodes == ()
+
+    def test_records_are_slotted_and_read_only(self):
+        assert not hasattr(EXPECTED, '__dict__')
+        try:
+            EXPECTED.title = 'Something else'
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError('record could be modified!')
+
+    def test_pickling(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(EXPECTED, protocol))
+            assert copy == EXPECTED
+            assert copy is not EXPECTED
+
+    def test_comparison(self):
+        other = ItemRecord(*EXPECTED.astuple())
+        assert other == EXPECTED
+        assert not other != EXPECTED
+        assert hash(other) == hash(EXPECTED)
+        assert ItemRecord('0201896842') != EXPECTED
+        assert len(set([EXPECTED, other, ItemRecord('0201896842')])) == 2
+        assert EXPECTED != '0201896834'
+
+    def test_invalid_arguments(self):
+        pytest.raises(TypeError, ItemRecord, foo='bar')
+        pytest.raises(TypeError, ItemRecord, '0201896834', asin='0201896834')
+        pytest.raises(TypeError, ItemRecord, *range(20))
+
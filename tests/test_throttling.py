@@ -0,0 +1,270 @@
+
+import os
+import pytest
+from StringIO import StringIO
+import tempfile
+import threading
+import urllib2
+
+from amazonproduct import API, MultiLocaleAPI, TooManyRequests
+from amazonproduct.throttling import TokenBucket, FileRateLimiter
+from amazonproduct.throttling import AdaptiveRateLimiter
+from amazonproduct.throttling import shared_limiter
+
+class FakeClock (object):
+
+    """
+    Clock which only advances when someone sleeps.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.waits = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket (object):
+
+    """
+    Test token bucket rate limiter.
+    """
+
+    def setup_method(self, method):
+        self.clock = FakeClock()
+
+    def bucket(self, rate=1, burst=1):
+        return TokenBucket(rate, burst, clock=self.clock,
+                           sleep=self.clock.sleep)
+
+    def test_requests_are_spaced_at_rate(self):
+        bucket = self.bucket(rate=2)
+        for i in range(5):
+            bucket.acquire()
+        assert self.clock.waits == [.5] * 4
+        assert self.clock.now == 2
+
+    def test_burst_after_idle_period(self):
+        bucket = self.bucket(rate=1, burst=3)
+        self.clock.now += 10
+        for i in range(3):
+            bucket.acquire()
+        assert self.clock.waits == []
+        bucket.acquire()
+        assert self.clock.waits == [1]
+
+    def test_clock_stepping_back(self):
+        bucket = self.bucket(rate=1, burst=1)
+        self.clock.now -= 600
+        bucket.acquire()
+        assert self.clock.waits == []
+        bucket.acquire()
+        assert self.clock.waits == [1]
+
+    def test_rate_can_be_changed(self):
+        bucket = self.bucket(rate=1)
+        bucket.acquire()
+        self.clock.now += .5
+        # half a token has been added at the old rate
+        bucket.set_rate(4)
+        bucket.acquire()
+        assert self.clock.waits == [.125]
+
+    def test_concurrent_callers_reserve_consecutive_slots(self):
+        bucket = self.bucket(rate=1)
+        waits = [bucket.reserve() for i in range(4)]
+        assert waits == [0, 1, 2, 3]
+
+    def test_bucket_is_thread_safe(self):
+        bucket = self.bucket(rate=1000)
+        waits = []
+        def reserve():
+            for i in range(100):
+                waits.append(bucket.reserve())
+        threads = [threading.Thread(target=reserve) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # all 400 tokens must have been handed out exactly once
+        assert sorted([round(w * 1000) for w in waits]) == range(400)
+
+
+class ThrottlingPool (object):
+
+    """
+    Connection pool answering the first ``n`` requests with HTTP 503.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.requests = 0
+
+    def urlopen(self, url, headers=None, debuglevel=0):
+        self.requests += 1
+        if self.requests <= self.n:
+            raise urllib2.HTTPError(url, 503, 'Service Unavailable', {},
+                                    StringIO(''))
+        fp = StringIO('<xml/>')
+        fp.headers = {}
+        return fp
+
+
+class TestAdaptiveRateLimiter (object):
+
+    """
+    Test rate limiter adapting to throttled requests (AIMD).
+    """
+
+    def setup_method(self, method):
+        self.clock = FakeClock()
+        self.limiter = AdaptiveRateLimiter(rate=1, min_rate=.25, max_rate=2,
+            increase=.5, decrease=.5, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_rate_increases_additively(self):
+        for rate in [1.5, 2, 2]:
+            self.limiter.success()
+            assert self.limiter.rate == rate
+
+    def test_rate_decreases_multiplicatively(self):
+        for rate in [.5, .25, .25]:
+            self.limiter.throttled()
+            assert self.limiter.rate == rate
+        # backoff is jittered around the new request interval
+        for wait, rate in zip(self.clock.waits, [.5, .25, .25]):
+            assert .5 / rate <= wait <= 1.5 / rate
+
+    def test_throttled_requests_are_retried(self):
+        pool = ThrottlingPool(2)
+        api = API('', '', 'de', pool=pool, limiter=self.limiter)
+        assert api._fetch('http://localhost/').read() == '<xml/>'
+        assert pool.requests == 3
+        assert self.limiter.rate == .25 + .5
+
+    def test_retries_are_limited(self):
+        pool = ThrottlingPool(10)
+        api = API('', '', 'de', pool=pool, limiter=self.limiter)
+        pytest.raises(TooManyRequests, api._fetch, 'http://localhost/')
+        assert pool.requests == api.MAX_RETRIES + 1
+
+    def test_non_adaptive_limiters_do_not_retry(self):
+        pool = ThrottlingPool(1)
+        api = API('', '', 'de', pool=pool, limiter=TokenBucket())
+        pytest.raises(TooManyRequests, api._fetch, 'http://localhost/')
+        assert pool.requests == 1
+
+
+class TestFileRateLimiter (object):
+
+    """
+    Test rate limiter shared between processes.
+    """
+
+    def setup_method(self, method):
+        fd, self.path = tempfile.mkstemp(suffix='.bucket')
+        os.close(fd)
+
+    def teardown_method(self, method):
+        os.remove(self.path)
+
+    def test_limiters_share_state_file(self):
+        limiter1 = FileRateLimiter(self.path, rate=1)
+        limiter2 = FileRateLimiter(self.path, rate=1)
+        waits = [limiter1.reserve(), limiter2.reserve(), limiter1.reserve()]
+        assert [round(w) for w in waits] == [0, 1, 2]
+
+    def test_update_in_the_future(self):
+        # state written by a clock which has since been set back
+        import struct, time
+        fp = open(self.path, 'wb')
+        fp.write(struct.pack(FileRateLimiter._format, 1, time.time() + 600))
+        fp.close()
+        limiter = FileRateLimiter(self.path, rate=1)
+        waits = [limiter.reserve(), limiter.reserve()]
+        assert [round(w) for w in waits] == [0, 1]
+
+    @pytest.mark.skipif('not hasattr(os, "fork")')
+    def test_forked_processes_share_budget(self):
+        # limiter is created *before* forking
+        limiter = FileRateLimiter(self.path, rate=1)
+        limiter.reserve()
+        pipes = []
+        for i in range(3):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0: # child
+                os.write(write, repr(limiter.reserve()))
+                os._exit(0)
+            os.close(write)
+            pipes.append((pid, read))
+        waits = []
+        for pid, read in pipes:
+            os.waitpid(pid, 0)
+            waits.append(float(os.read(read, 100)))
+            os.close(read)
+        assert sorted([round(w) for w in waits]) == [1, 2, 3]
+
+
+class TestSharedLimiter (object):
+
+    """
+    Test that API instances with the same credentials share their budget.
+    """
+
+    def test_same_key_shares_limiter(self):
+        api1 = API('KEY1', '', 'de')
+        api2 = API('KEY1', '', 'de')
+        api3 = API('KEY2', '', 'de')
+        assert api1.limiter is api2.limiter
+        assert api1.limiter is not api3.limiter
+        assert api1.limiter is shared_limiter('KEY1', locale='de')
+
+    def test_rate_does_not_split_budget(self):
+        class FasterAPI (API):
+            REQUESTS_PER_SECOND = 2
+        api1 = API('KEY3', '', 'de')
+        api2 = FasterAPI('KEY3', '', 'de')
+        assert api1.limiter is api2.limiter
+        assert shared_limiter('KEY3', rate=5, locale='de') is api1.limiter
+        assert api1.limiter.rate == 1
+
+    def test_each_locale_has_own_limiter(self):
+        api1 = API('KEY1', '', 'de')
+        api2 = API('KEY1', '', 'uk')
+        assert api1.limiter is not api2.limiter
+
+    def test_multi_locale_api_shares_limiters(self):
+        api = API('KEY1', '', 'de')
+        multi = MultiLocaleAPI('KEY1', '', ['de', 'uk'])
+        assert multi.apis['de'].limiter is api.limiter
+        assert multi.apis['uk'].limiter is API('KEY1', '', 'uk').limiter
+        assert multi.apis['de'].limiter is not multi.apis['uk'].limiter
+
+    def test_explicit_limiter_is_used(self):
+        limiter = TokenBucket(rate=2)
+        api = API('KEY1', '', 'de', limiter=limiter)
+        assert api.limiter is limiter
+        assert api.throttle.microseconds == 500000
+
+    def test_limiter_without_rate(self):
+        class Limiter (object):
+            def acquire(self):
+                pass
+        api = API('KEY1', '', 'de', limiter=Limiter())
+        assert api.throttle is None
+        pytest.raises(TypeError, setattr, api, 'throttle', 1)
+
+    def test_throttle_can_be_set(self):
+        from datetime import timedelta
+        api = API('KEY1', '', 'de', limiter=TokenBucket(rate=1))
+        api.throttle = .5
+        assert api.limiter.rate == 2
+        assert api.throttle == timedelta(seconds=.5)
+        api.throttle = timedelta(seconds=4)
+        assert api.limiter.rate == .25
+        pytest.raises(ValueError, setattr, api, 'throttle', 0)